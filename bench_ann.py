@@ -0,0 +1,77 @@
+"""Recall@k and QPS of the IVF index against exact search.
+
+    python bench_ann.py --rows 200000 --dim 64
+    python bench_ann.py --db tonga_sqf_vectors.db --metric l2
+"""
+import argparse
+import sqlite3
+import time
+import numpy as np
+import sqf_ann
+
+# Gaussian clusters stand in for a large multi-lexicon SQF table.
+def synthetic(rows, dim, clusters, seed):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim)).astype(np.float32) * 4
+    data = centers[rng.integers(clusters, size=rows)] + rng.normal(size=(rows, dim)).astype(np.float32)
+    return np.arange(1, rows + 1, dtype=np.int64), data
+
+def from_db(path):
+    conn = sqlite3.connect(path)
+    rows = conn.execute("SELECT rowid, vector FROM vocab WHERE vector IS NOT NULL ORDER BY rowid").fetchall()
+    conn.close()
+    if not rows:
+        return np.empty(0, dtype=np.int64), np.empty((0, 0), dtype=np.float32)
+    ids = np.array([r[0] for r in rows], dtype=np.int64)
+    data = np.frombuffer(b"".join(r[1] for r in rows), dtype="<f4").reshape(len(rows), -1)
+    return ids, data.astype(np.float32)
+
+def timed(fn, queries):
+    start = time.perf_counter()
+    result = fn(queries)
+    return result, len(queries) / (time.perf_counter() - start)
+
+def recall(found, truth):
+    hits = sum(len(np.intersect1d(f[f >= 0], t)) for f, t in zip(found, truth))
+    return hits / truth.size
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--db", help="benchmark the vocab table of this database instead of synthetic data")
+    ap.add_argument("--rows", type=int, default=200000)
+    ap.add_argument("--dim", type=int, default=64)
+    ap.add_argument("--clusters", type=int, default=500)
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--k", type=int, default=20)
+    ap.add_argument("--metric", choices=sqf_ann.METRICS, default="cosine")
+    ap.add_argument("--nlist", type=int, default=None)
+    ap.add_argument("--nprobe", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32, 64])
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+
+    ids, data = from_db(args.db) if args.db else synthetic(args.rows, args.dim, args.clusters, args.seed)
+    if len(data) == 0:
+        ap.error("no vectors to benchmark")
+    rng = np.random.default_rng(args.seed + 1)
+    queries = data[rng.choice(len(data), min(args.queries, len(data)), replace=False)]
+    queries = queries + rng.normal(scale=0.1, size=queries.shape).astype(np.float32)
+    print(f"rows={len(data)} dim={data.shape[1]} queries={len(queries)} k={args.k} metric={args.metric}")
+
+    start = time.perf_counter()
+    index = sqf_ann.IVFIndex.build(ids, data, nlist=args.nlist, metric=args.metric, seed=args.seed)
+    print(f"IVF build: nlist={index.nlist} in {time.perf_counter() - start:.2f}s")
+
+    sq_norms = np.einsum("ij,ij->i", data, data)
+    (truth, _), qps = timed(
+        lambda q: sqf_ann.exact_search(ids, data, q, k=args.k, metric=args.metric, sq_norms=sq_norms), queries
+    )
+    print(f"{'method':<16}{'recall@' + str(args.k):>12}{'QPS':>12}")
+    print(f"{'exact':<16}{1.0:>12.3f}{qps:>12.1f}")
+    for nprobe in args.nprobe:
+        if nprobe > index.nlist:
+            break
+        (found, _), qps = timed(lambda q: index.search(q, k=args.k, nprobe=nprobe), queries)
+        print(f"{'ivf nprobe=' + str(nprobe):<16}{recall(found, truth):>12.3f}{qps:>12.1f}")
+
+if __name__ == "__main__":
+    main()
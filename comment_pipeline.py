@@ -0,0 +1,205 @@
+import csv
+import io
+import json
+import re
+import threading
+import zipfile
+from abc import ABC, abstractmethod
+from itertools import islice
+from tempfile import SpooledTemporaryFile
+from openpyxl import load_workbook
+
+# =============================
+# Comment extraction (Excel / CSV)
+# =============================
+# Timestamps like "1d", "2h", "15m"; the cell right above one is a comment.
+COMMENT_TIMESTAMP = re.compile(r'^\d+\s*[dhm]$', re.IGNORECASE)
+COMMENT_META = ("edited", "reply")
+
+def workbook_sheets(file):
+    file.seek(0)
+    wb = load_workbook(filename=file, read_only=True)
+    try:
+        return wb.sheetnames, wb.active.title
+    finally:
+        wb.close()
+
+# First-column values streamed row by row from a read-only workbook, so only
+# the current row is ever materialised. A None between sheets keeps a comment
+# from pairing with a timestamp on the next sheet.
+def iter_xlsx_column(file, sheets=None):
+    file.seek(0)
+    wb = load_workbook(filename=file, read_only=True, data_only=True)
+    try:
+        for name in sheets or [wb.active.title]:
+            for row in wb[name].iter_rows(min_col=1, max_col=1, values_only=True):
+                yield row[0] if row else None
+            yield None
+    finally:
+        wb.close()
+
+def iter_csv_column(file):
+    file.seek(0)
+    text = io.TextIOWrapper(file, encoding="utf-8-sig", errors="replace", newline="")
+    try:
+        for row in csv.reader(text):
+            yield row[0] if row else None
+    finally:
+        text.detach()
+
+def iter_comment_cells(file, name, sheets=None):
+    if name.lower().endswith(".csv"):
+        return iter_csv_column(file)
+    return iter_xlsx_column(file, sheets)
+
+# One pass over the column: a timestamp cell (skipping "Edited"/"Reply" meta)
+# emits the non-empty cell immediately before it.
+def extract_comments(values):
+    prev = None
+    for cell in values:
+        if cell is not None:
+            cell_str = str(cell).strip()
+            if cell_str.lower() not in COMMENT_META and COMMENT_TIMESTAMP.match(cell_str):
+                if prev is not None and str(prev).strip() != "":
+                    yield str(prev).strip()
+        prev = cell
+
+# =============================
+# Export writers
+# =============================
+# Every writer streams into its own spooled temp file: kept in memory while
+# small, rolled over to disk past SPOOL_MAX_SIZE. The lock serialises the
+# script thread (preview) and download callbacks, which both seek the file.
+SPOOL_MAX_SIZE = 8 * 1024 * 1024
+ZIP_CHUNK_BYTES = 5 * 1024
+
+class CommentWriter(ABC):
+    file_name = "comments"
+    mime = "application/octet-stream"
+
+    def __init__(self):
+        self.file = SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+        self.lock = threading.Lock()
+
+    @abstractmethod
+    def write(self, comment):
+        ...
+
+    def close(self):
+        pass
+
+    def read(self):
+        with self.lock:
+            self.file.seek(0)
+            return self.file.read()
+
+    def discard(self):
+        self.file.close()
+
+class CsvWriter(CommentWriter):
+    file_name = "comments.csv"
+    mime = "text/csv"
+
+    def __init__(self):
+        super().__init__()
+        self.text = io.TextIOWrapper(self.file, encoding="utf-8", newline="")
+        self.writer = csv.writer(self.text)
+        self.writer.writerow(["Comment"])
+
+    def write(self, comment):
+        self.writer.writerow([comment])
+
+    def close(self):
+        self.text.flush()
+
+    # Rows [offset, offset + limit) re-read from the spooled CSV, so the
+    # preview never needs the full comment list in memory.
+    def page(self, offset, limit):
+        with self.lock:
+            self.file.seek(0)
+            text = io.TextIOWrapper(self.file, encoding="utf-8", newline="")
+            try:
+                rows = islice(csv.reader(text), offset + 1, offset + 1 + limit)
+                return [row[0] for row in rows]
+            finally:
+                text.detach()
+
+class TxtWriter(CommentWriter):
+    file_name = "comments.txt"
+    mime = "text/plain"
+
+    def __init__(self):
+        super().__init__()
+        self.sep = b""
+
+    def write(self, comment):
+        self.file.write(self.sep + comment.encode("utf-8"))
+        self.sep = b"\n"
+
+def json_string(text):
+    return json.dumps(text, ensure_ascii=False).encode("utf-8")
+
+# Same bytes as json.dumps(comments, indent=2, ensure_ascii=False).
+class JsonWriter(CommentWriter):
+    file_name = "comments.json"
+    mime = "application/json"
+
+    def __init__(self):
+        super().__init__()
+        self.sep = b"[\n  "
+
+    def write(self, comment):
+        self.file.write(self.sep + json_string(comment))
+        self.sep = b",\n  "
+
+    def close(self):
+        self.file.write(b"[]" if self.sep == b"[\n  " else b"\n]")
+
+# TXT parts of at most ZIP_CHUNK_BYTES each (a longer comment gets its own part).
+class ZipChunkWriter(CommentWriter):
+    file_name = "comments_chunks.zip"
+    mime = "application/zip"
+
+    def __init__(self, chunk_bytes=ZIP_CHUNK_BYTES):
+        super().__init__()
+        self.zip = zipfile.ZipFile(self.file, "w", zipfile.ZIP_DEFLATED)
+        self.chunk_bytes = chunk_bytes
+        self.chunk = []
+        self.size = 0
+        self.part = 1
+
+    def flush_chunk(self):
+        self.zip.writestr(f"comments_part{self.part}.txt", b"".join(self.chunk))
+        self.part += 1
+        self.chunk = []
+        self.size = 0
+
+    def write(self, comment):
+        line = (comment + "\n").encode("utf-8")
+        if self.size + len(line) > self.chunk_bytes and self.chunk:
+            self.flush_chunk()
+        self.chunk.append(line)
+        self.size += len(line)
+
+    def close(self):
+        if self.chunk:
+            self.flush_chunk()
+        self.zip.close()
+
+WRITERS = {"CSV": CsvWriter, "TXT": TxtWriter, "JSON": JsonWriter, "ZIP": ZipChunkWriter}
+
+# Drives comments through every writer in a single pass; returns
+# (count, writers) with each writer closed and ready to read().
+def run_pipeline(comments, formats=WRITERS):
+    writers = {name: cls() for name, cls in formats.items()}
+    count = 0
+    for comment in comments:
+        for writer in writers.values():
+            writer.write(comment)
+        count += 1
+    for writer in writers.values():
+        writer.close()
+    return count, writers
+
+def extract_to_writers(file, name, sheets=None, formats=WRITERS):
+    return run_pipeline(extract_comments(iter_comment_cells(file, name, sheets)), formats)
@@ -0,0 +1,89 @@
+import sqlite3
+from contextlib import contextmanager
+from functools import lru_cache
+from queue import Empty, Full, LifoQueue
+
+# =============================
+# SHARED SQLITE LAYER (lsg.py + neurograph.py)
+# =============================
+PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",   # safe with WAL, one fsync per checkpoint instead of per commit
+    "cache_size": -65536,      # 64 MiB page cache per connection
+    "mmap_size": 268435456,    # 256 MiB memory-mapped reads
+    "temp_store": "MEMORY",
+    "busy_timeout": 5000,
+}
+STATEMENT_CACHE_SIZE = 512     # prepared statements kept per connection
+MAX_IDLE = 8
+
+# Connections are checked out by one thread at a time and returned to a LIFO
+# queue, so every Streamlit script thread gets its own connection (and its own
+# cursors) while warm connections and their prepared statements are reused.
+# Connections run in autocommit mode; use transaction() to group writes.
+class ConnectionPool:
+    def __init__(self, path, max_idle=MAX_IDLE, pragmas=None):
+        self.path = path
+        self.pragmas = dict(PRAGMAS, **(pragmas or {}))
+        self._idle = LifoQueue(maxsize=max_idle)
+        self._closed = False
+
+    def _open(self):
+        conn = sqlite3.connect(
+            self.path,
+            check_same_thread=False,
+            isolation_level=None,
+            cached_statements=STATEMENT_CACHE_SIZE,
+            timeout=self.pragmas["busy_timeout"] / 1000,
+        )
+        for name, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {name}={value}")
+        return conn
+
+    def _release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        if self._closed:
+            conn.close()
+            return
+        try:
+            self._idle.put_nowait(conn)
+        except Full:
+            conn.close()
+
+    @contextmanager
+    def connection(self):
+        try:
+            conn = self._idle.get_nowait()
+        except Empty:
+            conn = self._open()
+        try:
+            yield conn
+        finally:
+            self._release(conn)
+
+    # BEGIN IMMEDIATE takes the write lock up front, so concurrent writers wait
+    # on busy_timeout instead of failing on a read-to-write upgrade.
+    @contextmanager
+    def transaction(self):
+        with self.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except Empty:
+                break
+
+# One pool per database file per process, shared by every session.
+@lru_cache(maxsize=None)
+def get_pool(path):
+    return ConnectionPool(path)
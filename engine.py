@@ -0,0 +1,170 @@
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# ---------------------------
+# Concurrent execution engine
+# ---------------------------
+# Max in-flight calls per outbound service, shared by every session.
+ENDPOINT_LIMITS = {"language": 4, "summary": 4, "chat": 3, "serp": 4, "feeds": 4}
+# Request-rate ceilings (requests per second) per outbound service; None = unlimited.
+ENDPOINT_RATES = {"language": 10.0, "summary": 10.0, "chat": 5.0, "serp": 2.0, "feeds": 4.0}
+
+# Process-wide pools and sessions, built on first use from the limits above.
+EXECUTORS = {}
+SESSIONS = {}
+ENGINE_LOCK = threading.Lock()
+
+# Override worker counts and/or request rates per endpoint. Pools and sessions
+# built under the old values are retired (calls already queued on them still
+# finish), so the new values apply to every later call whatever ran before.
+def configure(limits=None, rates=None):
+    with ENGINE_LOCK:
+        ENDPOINT_LIMITS.update(limits or {})
+        ENDPOINT_RATES.update(rates or {})
+        for pool in EXECUTORS.values():
+            pool.shutdown(wait=False)
+        EXECUTORS.clear()
+        SESSIONS.clear()
+
+# One worker pool per endpoint, so a burst on one service is capped at its own
+# limit and never starves calls to the others.
+def get_executor(endpoint):
+    with ENGINE_LOCK:
+        pool = EXECUTORS.get(endpoint)
+        if pool is None:
+            pool = EXECUTORS[endpoint] = ThreadPoolExecutor(
+                max_workers=ENDPOINT_LIMITS[endpoint], thread_name_prefix=f"cyclops-{endpoint}"
+            )
+        return pool
+
+def submit(endpoint, fn, *args, **kwargs):
+    return get_executor(endpoint).submit(fn, *args, **kwargs)
+
+def run_on(endpoint, fn, *args, **kwargs):
+    return submit(endpoint, fn, *args, **kwargs).result()
+
+# Run the generator fn(*args) on the endpoint's pool and return a generator
+# that replays its chunks in the calling (script) thread, e.g. for
+# st.write_stream. The call starts immediately and buffers until read.
+STREAM_END = object()
+
+def stream_on(endpoint, fn, *args, **kwargs):
+    chunks = queue.Queue()
+
+    def run():
+        try:
+            for chunk in fn(*args, **kwargs):
+                chunks.put(chunk)
+        except Exception as e:
+            chunks.put(e)
+        finally:
+            chunks.put(STREAM_END)
+
+    submit(endpoint, run)
+
+    def replay():
+        while True:
+            chunk = chunks.get()
+            if chunk is STREAM_END:
+                return
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield chunk
+    return replay()
+
+# Run fn(item) for every item and yield (item, result, error) as each call
+# finishes, so the script thread can render results as they arrive.
+def fan_out(endpoint, fn, items):
+    futures = {submit(endpoint, fn, item): item for item in items}
+    for fut in as_completed(futures):
+        try:
+            yield futures[fut], fut.result(), None
+        except Exception as e:
+            yield futures[fut], None, e
+
+# ---------------------------
+# Pooled, rate-limited HTTP sessions
+# ---------------------------
+HTTP_RETRIES = 4
+HTTP_BACKOFF = 1.0            # retries at once, then sleeps 2s, 4s, 8s unless Retry-After says otherwise
+HTTP_RETRY_STATUSES = (429, 500, 502, 503, 504)
+HTTP_POST_RETRY_STATUSES = (429, 503)
+
+# POSTs are not idempotent: a read error or a 500/502/504 may come after the
+# service acted on the request (submitted a job, billed a completion), so
+# POSTs are only retried when it was rejected unprocessed (429, 503) or the
+# connection never opened.
+class EndpointRetry(Retry):
+    def is_retry(self, method, status_code, has_retry_after=False):
+        if method == "POST" and status_code not in HTTP_POST_RETRY_STATUSES:
+            return False
+        return super().is_retry(method, status_code, has_retry_after)
+
+    def increment(self, method=None, *args, **kwargs):
+        retry = self.new(read=False) if method == "POST" else self
+        return Retry.increment(retry, method, *args, **kwargs)
+
+# Token bucket shared by every thread using one endpoint: at most `rate`
+# requests per second on average, with bursts of up to `burst`.
+class RateLimiter:
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate or 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if not self.rate:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+class RateLimitedSession(requests.Session):
+    def __init__(self, limiter):
+        super().__init__()
+        self.limiter = limiter
+
+    def request(self, *args, **kwargs):
+        self.limiter.acquire()
+        return super().request(*args, **kwargs)
+
+# One keep-alive session per endpoint, reused across reruns and sessions. The
+# connection pool matches the endpoint's worker count so every worker keeps a
+# warm TLS connection. Failed requests are retried with exponential backoff,
+# honouring Retry-After (see EndpointRetry for POSTs). Every request first waits on the endpoint's rate limit.
+def get_session(endpoint, pool_size=None):
+    with ENGINE_LOCK:
+        session = SESSIONS.get((endpoint, pool_size))
+        if session is None:
+            session = SESSIONS[endpoint, pool_size] = new_session(endpoint, pool_size)
+        return session
+
+def new_session(endpoint, pool_size=None):
+    retry = EndpointRetry(
+        total=HTTP_RETRIES,
+        backoff_factor=HTTP_BACKOFF,
+        status_forcelist=HTTP_RETRY_STATUSES,
+        allowed_methods=frozenset({"GET", "POST"}),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    size = pool_size or ENDPOINT_LIMITS[endpoint]
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=size, max_retries=retry)
+    session = RateLimitedSession(RateLimiter(ENDPOINT_RATES.get(endpoint)))
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
@@ -0,0 +1,520 @@
+"""Incremental crawler for the FEEDS news sources.
+
+Each cycle costs requests in proportion to what changed: feed pages are
+fetched with conditional GETs (ETag / Last-Modified), a feed whose article
+links are unchanged stops there, and only unseen article URLs (plus a capped
+re-check of recent ones) are downloaded. Article text is hashed, so unchanged
+pages and syndicated copies are never re-analysed. New articles are queued in
+feed_articles and sent through fetch.run_jobs for sentiment and extractive
+summary, saving scans into inference.db as operator "feeds".
+
+    python feeds.py --once
+    python feeds.py --interval 900 --feeds "Lusaka Times" ZNBC
+"""
+import argparse
+import hashlib
+import re
+import sys
+import threading
+import time
+import xml.etree.ElementTree as ET
+from html.parser import HTMLParser
+from urllib.parse import urldefrag, urljoin, urlparse
+import fetch
+import store
+from engine import fan_out, get_session, submit
+
+FEEDS = {
+    "Mast Media (Politics)": "https://mastmediazm.com/category/politics/",
+    "Lusaka Times": "https://www.lusakatimes.com",
+    "ZNBC": "https://znbc.co.zm",
+    "Makanday": "https://makanday.org",
+    "SABC News": "https://www.sabcnews.com",
+    "Zambian Observer": "https://www.zambianobserver.com",
+    "Mwebantu": "https://www.mwebantu.com/",
+    "Daily Mail": "https://www.daily-mail.co.zm"
+}
+
+FEED_USER_AGENT = "Mozilla/5.0 (compatible; CyclopsFeeds/1.0)"
+FEED_TIMEOUT = 20
+FEED_MAX_NEW = 20               # new articles downloaded per feed per cycle
+FEED_RECHECK_WINDOW = 24 * 3600 # recent articles are re-checked for edits...
+FEED_RECHECK_AFTER = 3600       # ...at most once an hour
+FEED_RECHECK_MAX = 40           # ...and at most this many per cycle
+FEED_ANALYZE_MAX = 50           # queued articles analysed per cycle
+FEED_MIN_WORDS = 6              # shorter <p> blocks are menus, captions, bylines
+FEED_OPERATOR = "feeds"
+
+# ---------------------------
+# Storage
+# ---------------------------
+# status: pending (listed by a feed, not downloaded yet: over the per-cycle cap,
+# or the download failed) -> new (queued for analysis) -> analyzed | failed;
+# duplicate and empty articles are stored but never queued. A pending article
+# that still fails to download after FEED_RECHECK_WINDOW becomes failed.
+def init_feed_schema(conn):
+    conn.executescript("""
+    CREATE TABLE IF NOT EXISTS feed_sources (
+        feed TEXT PRIMARY KEY,
+        url TEXT NOT NULL,
+        rss_url TEXT,
+        etag TEXT,
+        last_modified TEXT,
+        content_hash TEXT,
+        checked_at REAL,
+        changed_at REAL,
+        error TEXT
+    );
+    CREATE TABLE IF NOT EXISTS feed_articles (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        feed TEXT NOT NULL,
+        url TEXT UNIQUE NOT NULL,
+        title TEXT,
+        etag TEXT,
+        last_modified TEXT,
+        content_hash TEXT,
+        text TEXT,
+        status TEXT NOT NULL DEFAULT 'new',
+        error TEXT,
+        first_seen REAL,
+        checked_at REAL,
+        changed_at REAL
+    );
+    CREATE INDEX IF NOT EXISTS idx_feed_articles_status ON feed_articles (status);
+    CREATE INDEX IF NOT EXISTS idx_feed_articles_hash ON feed_articles (content_hash);
+    CREATE INDEX IF NOT EXISTS idx_feed_articles_feed ON feed_articles (feed, first_seen);
+    """)
+
+def init_feeds_db():
+    store.init_db()
+    with store.get_conn() as conn:
+        init_feed_schema(conn)
+
+def content_hash(text):
+    return hashlib.sha256(" ".join(text.split()).encode("utf-8")).hexdigest()
+
+# ---------------------------
+# Parsing (stdlib only)
+# ---------------------------
+SKIP_TAGS = {"script", "style", "noscript", "nav", "header", "footer", "aside", "form", "svg"}
+NON_ARTICLE = re.compile(r'/(category|tag|author|page|feed|wp-|search|about|contact|privacy)', re.IGNORECASE)
+ARTICLE_PATH = re.compile(r'/20\d\d/|/[a-z0-9]+(?:-[a-z0-9]+){3,}/?$', re.IGNORECASE)
+
+# One pass over a page collecting links, RSS alternates, <title>/og: metadata
+# and paragraph text (preferring paragraphs inside <article>).
+class PageParser(HTMLParser):
+    def __init__(self, base_url):
+        super().__init__(convert_charrefs=True)
+        self.base_url = base_url
+        self.links = []
+        self.rss = []
+        self.meta = {}
+        self.title = ""
+        self.paragraphs = []
+        self.article_paragraphs = []
+        self.skip = 0
+        self.article = 0
+        self.anchor = None
+        self.in_title = False
+        self.buf = None
+
+    def handle_starttag(self, tag, attrs):
+        a = dict(attrs)
+        if tag in SKIP_TAGS:
+            self.skip += 1
+        elif tag == "article":
+            self.article += 1
+        elif tag == "title":
+            self.in_title = True
+        elif tag == "p" and not self.skip:
+            self.buf = []
+        elif tag == "a" and a.get("href"):
+            self.anchor = [urldefrag(urljoin(self.base_url, a["href"]))[0], []]
+        elif tag == "link" and "alternate" in (a.get("rel") or "") and "rss" in (a.get("type") or "") and a.get("href"):
+            self.rss.append(urljoin(self.base_url, a["href"]))
+        elif tag == "meta" and a.get("content"):
+            name = a.get("property") or a.get("name")
+            if name in ("og:title", "og:image", "og:description", "description"):
+                self.meta.setdefault(name, a["content"])
+
+    def handle_endtag(self, tag):
+        if tag in SKIP_TAGS:
+            self.skip = max(self.skip - 1, 0)
+        elif tag == "article":
+            self.article = max(self.article - 1, 0)
+        elif tag == "title":
+            self.in_title = False
+        elif tag == "p" and self.buf is not None:
+            text = " ".join("".join(self.buf).split())
+            if len(text.split()) >= FEED_MIN_WORDS:
+                (self.article_paragraphs if self.article else self.paragraphs).append(text)
+            self.buf = None
+        elif tag == "a" and self.anchor:
+            self.links.append((self.anchor[0], " ".join("".join(self.anchor[1]).split())))
+            self.anchor = None
+
+    def handle_data(self, data):
+        if self.in_title:
+            self.title += data
+        if self.skip:
+            return
+        if self.buf is not None:
+            self.buf.append(data)
+        if self.anchor:
+            self.anchor[1].append(data)
+
+    def text(self):
+        return "\n\n".join(self.article_paragraphs or self.paragraphs)
+
+def parse_page(body, base_url):
+    parser = PageParser(base_url)
+    parser.feed(body)
+    parser.close()
+    return parser
+
+def same_site(url, base_url):
+    host = urlparse(url).netloc.lower().removeprefix("www.")
+    return host == urlparse(base_url).netloc.lower().removeprefix("www.")
+
+# Article links on a section/home page: same site, slug- or date-like paths.
+# A story is often linked twice (thumbnail, then headline); keep the text.
+def html_article_links(page, base_url):
+    out = {}
+    for url, title in page.links:
+        path = urlparse(url).path
+        if not same_site(url, base_url) or NON_ARTICLE.search(path) or not ARTICLE_PATH.search(path):
+            continue
+        if not out.get(url):
+            out[url] = title
+    return list(out.items())
+
+def rss_article_links(body):
+    root = ET.fromstring(body)
+    out = []
+    for item in root.iter("item"):
+        link, title = item.findtext("link"), item.findtext("title")
+        if link:
+            out.append((link.strip(), (title or "").strip()))
+    atom = "{http://www.w3.org/2005/Atom}"
+    for entry in root.iter(f"{atom}entry"):
+        link = entry.find(f"{atom}link")
+        if link is not None and link.get("href"):
+            out.append((link.get("href"), (entry.findtext(f"{atom}title") or "").strip()))
+    return out
+
+# ---------------------------
+# Conditional fetches
+# ---------------------------
+# Returns the response, or None on 304 Not Modified.
+def conditional_get(url, etag=None, last_modified=None):
+    headers = {"User-Agent": FEED_USER_AGENT}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    resp = get_session("feeds").get(url, headers=headers, timeout=FEED_TIMEOUT)
+    if resp.status_code == 304:
+        return None
+    resp.raise_for_status()
+    return resp
+
+# Phase 1 (per feed): conditional GET of the feed (its RSS once discovered,
+# else the page itself); returns (feed, status, links, source) where source is
+# the feed_sources row to save (None on 304). Nothing is written here but
+# checked_at: crawl saves the validators and link-set hash together with the
+# listed URLs, so a feed never short-circuits past articles it has not
+# recorded.
+def check_feed(feed):
+    name, url = feed
+    with store.get_conn() as conn:
+        row = conn.execute("SELECT rss_url, etag, last_modified, content_hash FROM feed_sources WHERE feed=?",
+                           (name,)).fetchone()
+    rss_url, etag, last_modified, old_hash = row or (None, None, None, None)
+    now = time.time()
+    fetched = rss_url or url
+    resp = conditional_get(fetched, etag, last_modified)
+    if resp is None:
+        with store.get_conn() as conn:
+            conn.execute("UPDATE feed_sources SET checked_at=?, error=NULL WHERE feed=?", (now, name))
+        return name, "not_modified", [], None
+
+    links = None
+    if rss_url:
+        try:
+            links = rss_article_links(resp.content)
+        except ET.ParseError:
+            # broken feed: read the page instead and rediscover
+            fetched = url
+            resp = conditional_get(url)
+    if links is None:
+        page = parse_page(resp.text, resp.url or url)
+        links = html_article_links(page, url)
+        rss_url = next((r for r in page.rss if "comments" not in r), None)
+    # validators only carry over when the next cycle fetches the same URL
+    if (rss_url or url) == fetched:
+        etag, last_modified = resp.headers.get("ETag"), resp.headers.get("Last-Modified")
+    else:
+        etag, last_modified = None, None
+
+    # Hash the link set rather than the body: pages embed timestamps and nonces.
+    new_hash = content_hash("\n".join(sorted(u for u, _ in links)))
+    source = (name, url, rss_url, etag, last_modified, new_hash, now, now)
+    if new_hash == old_hash:
+        return name, "unchanged", [], source
+    return name, "changed", links, source
+
+# Saves the feed's validators and link-set hash together with every listed URL
+# not seen before (as pending), in one transaction.
+def record_feed(source, links):
+    feed, now = source[0], source[6]
+    with store.transaction() as conn:
+        conn.executemany("""
+            INSERT INTO feed_articles (feed, url, title, status, first_seen, checked_at)
+            VALUES (?,?,?,'pending',?,0) ON CONFLICT(url) DO NOTHING
+        """, [(feed, u, t, now) for u, t in links])
+        conn.execute("""
+            INSERT INTO feed_sources (feed, url, rss_url, etag, last_modified, content_hash, checked_at, changed_at)
+            VALUES (?,?,?,?,?,?,?,?)
+            ON CONFLICT(feed) DO UPDATE SET
+                url=excluded.url, rss_url=excluded.rss_url, etag=excluded.etag,
+                last_modified=excluded.last_modified, content_hash=excluded.content_hash,
+                checked_at=excluded.checked_at, error=NULL,
+                changed_at=CASE WHEN feed_sources.content_hash IS excluded.content_hash
+                                THEN feed_sources.changed_at ELSE excluded.changed_at END
+        """, source)
+
+# Phase 2 (per article): download and extract; None when not modified.
+def fetch_article(item):
+    feed, url, title, etag, last_modified = item
+    resp = conditional_get(url, etag, last_modified)
+    if resp is None:
+        return None
+    page = parse_page(resp.text, resp.url or url)
+    title = page.meta.get("og:title") or " ".join(page.title.split()) or title
+    text = page.text()
+    return {"title": title, "text": text, "hash": content_hash(text) if text else None,
+            "etag": resp.headers.get("ETag"), "last_modified": resp.headers.get("Last-Modified")}
+
+# Insert or update one downloaded article; returns its new status or None when
+# the text did not change.
+def store_article(item, article):
+    feed, url = item[0], item[1]
+    now = time.time()
+    with store.get_conn() as conn:
+        old = conn.execute("SELECT content_hash, status FROM feed_articles WHERE url=?", (url,)).fetchone()
+        if old and old[1] != "pending" and old[0] == article["hash"]:
+            conn.execute("UPDATE feed_articles SET etag=?, last_modified=?, checked_at=? WHERE url=?",
+                         (article["etag"], article["last_modified"], now, url))
+            return None
+        if not article["text"]:
+            status = "empty"
+        elif conn.execute("SELECT 1 FROM feed_articles WHERE content_hash=? AND url<>?",
+                          (article["hash"], url)).fetchone():
+            status = "duplicate"
+        else:
+            status = "new"
+        conn.execute("""
+            INSERT INTO feed_articles (feed, url, title, etag, last_modified, content_hash, text, status,
+                                       first_seen, checked_at, changed_at)
+            VALUES (?,?,?,?,?,?,?,?,?,?,?)
+            ON CONFLICT(url) DO UPDATE SET
+                title=excluded.title, etag=excluded.etag, last_modified=excluded.last_modified,
+                content_hash=excluded.content_hash, text=excluded.text, status=excluded.status,
+                error=NULL, checked_at=excluded.checked_at, changed_at=excluded.changed_at
+        """, (feed, url, article["title"], article["etag"], article["last_modified"], article["hash"],
+              article["text"], status, now, now, now))
+    return status
+
+# ---------------------------
+# Feed snapshots (monitor panel)
+# ---------------------------
+FEED_SNAPSHOT_TTL = 600
+FEED_SNAPSHOT_HEADLINES = 6
+
+# Headlines and og:image of one feed page. A previous snapshot's validators
+# make the refresh a conditional GET; 304 keeps the old snapshot.
+def feed_snapshot(url, previous=None):
+    previous = previous or {}
+    resp = conditional_get(url, previous.get("etag"), previous.get("last_modified"))
+    if resp is None:
+        return dict(previous, fetched_at=time.time())
+    page = parse_page(resp.text, resp.url or url)
+    headlines = [(u, t) for u, t in html_article_links(page, url) if t]
+    return {
+        "headlines": headlines[:FEED_SNAPSHOT_HEADLINES],
+        "image": page.meta.get("og:image"),
+        "etag": resp.headers.get("ETag"),
+        "last_modified": resp.headers.get("Last-Modified"),
+        "fetched_at": time.time(),
+    }
+
+# Process-wide snapshot cache shared by every session, and the feeds whose
+# refresh is in flight; both only change under FEED_SNAPSHOTS_LOCK.
+FEED_SNAPSHOTS = {}
+FEED_REFRESHING = set()
+FEED_SNAPSHOTS_LOCK = threading.Lock()
+FEED_SNAPSHOT_LOADING = {"headlines": [], "image": None, "loading": True}
+
+# Runs on the feeds pool. A failed refresh keeps the stale snapshot and
+# records the error.
+def refresh_feed_snapshot(name):
+    with FEED_SNAPSHOTS_LOCK:
+        previous = FEED_SNAPSHOTS.get(name)
+    try:
+        snap = feed_snapshot(FEEDS[name], previous)
+        snap.pop("error", None)
+    except Exception as e:
+        snap = dict(previous or {"headlines": [], "image": None}, error=str(e), fetched_at=time.time())
+    with FEED_SNAPSHOTS_LOCK:
+        FEED_SNAPSHOTS[name] = snap
+        FEED_REFRESHING.discard(name)
+
+# Snapshots for the named feeds, stale-while-revalidate: callers never wait on
+# a site. Entries older than ttl are returned as they are while one refresh
+# per feed runs on the feeds pool; a feed never fetched yet is returned as
+# FEED_SNAPSHOT_LOADING until its first refresh lands.
+def feed_snapshots(names, ttl=FEED_SNAPSHOT_TTL):
+    now = time.time()
+    with FEED_SNAPSHOTS_LOCK:
+        stale = [name for name in names if name not in FEED_REFRESHING
+                 and now - FEED_SNAPSHOTS.get(name, {}).get("fetched_at", 0) > ttl]
+        FEED_REFRESHING.update(stale)
+        snapshots = {name: FEED_SNAPSHOTS.get(name, FEED_SNAPSHOT_LOADING) for name in names}
+    for name in stale:
+        submit("feeds", refresh_feed_snapshot, name)
+    return snapshots
+
+# ---------------------------
+# Crawl cycle
+# ---------------------------
+# Pending articles due for a download: never tried, or failed at least
+# FEED_RECHECK_AFTER ago. At most FEED_MAX_NEW per feed, oldest first.
+def pending_articles(feeds, now):
+    items = []
+    with store.get_conn() as conn:
+        for name in feeds:
+            items.extend(conn.execute("""
+                SELECT feed, url, title, etag, last_modified FROM feed_articles
+                WHERE feed=? AND status='pending' AND checked_at < ?
+                ORDER BY first_seen, id LIMIT ?
+            """, (name, now - FEED_RECHECK_AFTER, FEED_MAX_NEW)).fetchall())
+    return items
+
+# A failed download stays pending (with its error) for a later cycle, until it
+# is older than FEED_RECHECK_WINDOW; a failed re-check only records the error.
+def record_article_error(url, exc, now):
+    with store.get_conn() as conn:
+        conn.execute("""
+            UPDATE feed_articles SET error=?, checked_at=?,
+                status=CASE WHEN status='pending' AND first_seen < ? THEN 'failed' ELSE status END
+            WHERE url=?
+        """, (f"download failed: {exc}", now, now - FEED_RECHECK_WINDOW, url))
+
+def record_feed_error(name, url, exc):
+    with store.get_conn() as conn:
+        conn.execute("""
+            INSERT INTO feed_sources (feed, url, checked_at, error) VALUES (?,?,?,?)
+            ON CONFLICT(feed) DO UPDATE SET checked_at=excluded.checked_at, error=excluded.error
+        """, (name, url, time.time(), str(exc)))
+
+# A feed that fails to check or record is logged on feed_sources and skipped;
+# the other feeds and the article downloads still run.
+def crawl(feeds=None, progress=print):
+    init_feeds_db()
+    feeds = feeds or FEEDS
+    stats = {"feeds_changed": 0, "new": 0, "updated": 0, "duplicate": 0, "errors": 0}
+    for (name, url), result, exc in fan_out("feeds", check_feed, list(feeds.items())):
+        if exc is None:
+            try:
+                _, status, links, source = result
+                if status != "not_modified":
+                    record_feed(source, links)
+            except Exception as e:
+                exc = e
+        if exc is not None:
+            stats["errors"] += 1
+            record_feed_error(name, url, exc)
+            progress(f"{name}: error: {exc}")
+            continue
+        progress(f"{name}: {status}")
+        if links:
+            stats["feeds_changed"] += 1
+
+    # listed articles not downloaded yet (new links, plus earlier cycles'
+    # overflow and failures), then recent articles whose pages may have been
+    # edited since the last check
+    now = time.time()
+    items = pending_articles(feeds, now)
+    new_urls = {item[1] for item in items}
+    with store.get_conn() as conn:
+        items.extend(conn.execute("""
+            SELECT feed, url, title, etag, last_modified FROM feed_articles
+            WHERE first_seen > ? AND checked_at < ? AND status NOT IN ('pending', 'failed')
+            ORDER BY checked_at LIMIT ?
+        """, (now - FEED_RECHECK_WINDOW, now - FEED_RECHECK_AFTER, FEED_RECHECK_MAX)).fetchall())
+
+    for item, article, exc in fan_out("feeds", fetch_article, items):
+        if exc is not None:
+            stats["errors"] += 1
+            record_article_error(item[1], exc, time.time())
+            progress(f"  {item[1]}: error: {exc}")
+            continue
+        if article is None:
+            with store.get_conn() as conn:
+                conn.execute("UPDATE feed_articles SET checked_at=? WHERE url=?", (time.time(), item[1]))
+            continue
+        status = store_article(item, article)
+        if status == "duplicate":
+            stats["duplicate"] += 1
+        elif status is not None:
+            stats["new" if item[1] in new_urls else "updated"] += 1
+    return stats
+
+# Queued (status "new") articles go through the same sentiment and summary
+# pipelines as uploads; each article is marked analyzed or failed.
+def analyze_queue(limit=FEED_ANALYZE_MAX, operator=FEED_OPERATOR, progress=print):
+    with store.get_conn() as conn:
+        rows = conn.execute("SELECT id, feed, url, title, text FROM feed_articles WHERE status='new' ORDER BY id LIMIT ?",
+                            (limit,)).fetchall()
+    if not rows:
+        return 0
+    jobs = []
+    for article_id, feed, url, title, text in rows:
+        context = f"{feed}: {title}" if title else feed
+        jobs.append({"kind": "sentiment", "doc_id": url, "text": text, "context": context, "article": article_id})
+        jobs.append({"kind": "summary", "doc_id": url, "text": text, "context": context, "article": article_id})
+    results = fetch.run_jobs(jobs, operator=operator)
+    errors = {}
+    for job, result in zip(jobs, results):
+        if result["status"] != "ok":
+            errors.setdefault(job["article"], result.get("error"))
+    with store.get_conn() as conn:
+        for article_id, *_ in rows:
+            conn.execute("UPDATE feed_articles SET status=?, error=? WHERE id=?",
+                         ("failed" if article_id in errors else "analyzed", errors.get(article_id), article_id))
+    progress(f"analysed {len(rows) - len(errors)}/{len(rows)} queued articles")
+    return len(rows)
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--feeds", nargs="*", choices=list(FEEDS), help="only these feeds (default: all)")
+    ap.add_argument("--once", action="store_true", help="run a single cycle and exit")
+    ap.add_argument("--interval", type=float, default=900, help="seconds between cycles (default: %(default)s)")
+    ap.add_argument("--no-analyze", action="store_true", help="crawl and queue only")
+    ap.add_argument("--db", default=store.DB_FILE, help="SQLite database (default: %(default)s)")
+    args = ap.parse_args(argv)
+    store.configure(args.db)
+    feeds = {name: FEEDS[name] for name in args.feeds} if args.feeds else FEEDS
+
+    while True:
+        start = time.perf_counter()
+        stats = crawl(feeds)
+        print(", ".join(f"{k}={v}" for k, v in stats.items()), flush=True)
+        if not args.no_analyze:
+            analyze_queue()
+        if args.once:
+            return 0
+        time.sleep(max(args.interval - (time.perf_counter() - start), 0))
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,263 @@
+"""Headless Cyclops fetch engine.
+
+Runs SerpAPI reports, Azure Language sentiment, extractive summaries and
+Azure OpenAI chat jobs concurrently (per-endpoint worker pools and rate
+limits, see engine.py) and saves every result into inference.db with
+save_scan, exactly as the neurograph.py tabs do. The API calls themselves
+live in services.py and summary_jobs.py, shared with neurograph.py.
+
+    python fetch.py jobs.jsonl --operator sweep-0412
+    python fetch.py jobs.json --rate serp=1 --workers chat=6 --out results.jsonl
+
+The job file is JSON lines (or one JSON list) of objects with a "kind":
+
+    {"kind": "report", "prompt": "vetting|opinion|brief", "query": "...", "doc_id": "...", "context": "", "num": 10}
+    {"kind": "sentiment", "doc_id": "...", "path": "notes.txt", "context": ""}
+    {"kind": "summary", "doc_id": "...", "text": "...", "context": ""}
+    {"kind": "chat", "doc_id": "...", "path": "transcript.txt", "question": "", "mode": "auto|map-reduce|whole"}
+
+Documents come from "text" or "path" (relative to the job file). Keys and
+endpoints are read from the environment (SERP_API_KEY, AZURE_API_KEY,
+CYCLOPS_ENDPOINT, TAB1_KEY, TAB1_URL, TAB2_KEY, TAB2_URL; CYCLOPS_DB for the
+database path).
+"""
+import argparse
+import json
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+import engine
+import store
+from engine import ENDPOINT_LIMITS, fan_out, submit
+from services import (
+    EMPTY_DOCUMENT, REPORT_PROMPTS, SETTINGS, call_serp_api, chat_completion, compact_serp,
+    copilot_answer_stream, is_empty_document, parse_report, report_payload, run_sentiment_stored,
+    sentiment_failure,
+)
+from store import document_hash, get_conn, init_db, save_scan
+from summary_jobs import SUMMARY_PENDING, poll_due_summary_jobs, submit_summary_job
+
+# ---------------------------
+# Batch jobs (headless)
+# ---------------------------
+JOB_KINDS = ("report", "sentiment", "summary", "chat")
+
+def load_jobs(path):
+    text = Path(path).read_text(encoding="utf-8")
+    if text.lstrip().startswith("["):
+        jobs = json.loads(text)
+    else:
+        jobs = [json.loads(line) for line in text.splitlines() if line.strip()]
+    for i, job in enumerate(jobs):
+        if job.get("kind") not in JOB_KINDS:
+            raise ValueError(f"Job {i}: kind must be one of {', '.join(JOB_KINDS)}")
+        if job["kind"] == "report":
+            if "query" not in job:
+                raise ValueError(f"Job {i}: report jobs need a query")
+            if job.get("prompt", "brief") not in REPORT_PROMPTS:
+                raise ValueError(f"Job {i}: prompt must be one of {', '.join(REPORT_PROMPTS)}")
+        elif "text" not in job and "path" not in job:
+            raise ValueError(f"Job {i}: {job['kind']} jobs need a text or a path")
+    return jobs
+
+def job_text(job, base_dir="."):
+    if "text" in job:
+        return job["text"]
+    return (Path(base_dir) / job["path"]).read_bytes().decode("utf-8", errors="ignore")
+
+def job_doc_id(job):
+    return job.get("doc_id") or job.get("query") or Path(job.get("path", "document")).name
+
+# Every driver records a failure against its own job only; one bad job (an
+# unreadable path, an unknown prompt) never fails the rest of its kind.
+def run_reports(jobs, operator, force_refresh, record):
+    chats = {}
+    fetch_serp = lambda job: call_serp_api(
+        job["query"], num=job.get("num", REPORT_PROMPTS[job.get("prompt", "brief")]["num"]),
+        force_refresh=force_refresh
+    )
+    for (i, job), serp, exc in fan_out("serp", lambda item: fetch_serp(item[1]), jobs):
+        if exc is not None:
+            record(i, job, error=exc)
+            continue
+        try:
+            serp_text, report = compact_serp(serp)
+            payload = report_payload(job.get("prompt", "brief"), job["query"], serp_text, job.get("context", ""))
+        except Exception as e:
+            record(i, job, error=e)
+            continue
+        fut = submit("chat", chat_completion, SETTINGS["CYCLOPS_ENDPOINT"], payload, SETTINGS["AZURE_API_KEY"],
+                     force_refresh)
+        chats[fut] = (i, job)
+    for fut in as_completed(chats):
+        i, job = chats[fut]
+        try:
+            output = fut.result() or "No model output returned."
+            sentiment, summary, context = parse_report(output)
+            scan = save_scan(operator, job_doc_id(job), sentiment, summary, context or job.get("context", ""))
+        except Exception as e:
+            record(i, job, error=e)
+            continue
+        record(i, job, scan=scan)
+
+def run_sentiments(jobs, operator, base_dir, record):
+    scored, files = [], []
+    for i, job in jobs:
+        try:
+            text = job_text(job, base_dir)
+        except Exception as e:
+            record(i, job, error=e)
+            continue
+        if is_empty_document(text):
+            record(i, job, error=EMPTY_DOCUMENT)
+            continue
+        scored.append((i, job))
+        files.append((job_doc_id(job), text))
+    results, hashes, reused = run_sentiment_stored(files, SETTINGS["TAB1_URL"], SETTINGS["TAB1_KEY"])
+    for (i, job), d, doc_hash, hit in zip(scored, results, hashes, reused):
+        if sentiment_failure(d):
+            record(i, job, error=sentiment_failure(d))
+            continue
+        scores = d.get("confidenceScores", {})
+        summary_txt = (f"Sentiment: {d.get('sentiment')}\n"
+                       f"Scores -> pos:{scores.get('positive')} neu:{scores.get('neutral')} neg:{scores.get('negative')}")
+        try:
+            scan = save_scan(operator, job_doc_id(job), d.get("sentiment"), summary_txt, job.get("context", ""), doc_hash)
+        except Exception as e:
+            record(i, job, error=e)
+            continue
+        record(i, job, scan=scan, reused=hit)
+
+# Submits every document, then polls only this run's jobs until they settle;
+# finished summaries are saved by poll_summary_job like in the UI.
+def run_summaries(jobs, operator, base_dir, record):
+    submit_job = lambda item: submit_summary_job(
+        operator, job_doc_id(item[1]), job_text(item[1], base_dir), item[1].get("context", "")
+    )
+    pending = {}
+    for (i, job), job_id, exc in fan_out("summary", submit_job, jobs):
+        if exc is not None:
+            record(i, job, error=exc)
+        else:
+            pending[job_id] = (i, job)
+    marks = ",".join("?" * len(SUMMARY_PENDING))
+    while pending:
+        poll_due_summary_jobs(set(pending))
+        with get_conn() as conn:
+            done = conn.execute(f"""
+                SELECT id, status, error FROM summary_jobs
+                WHERE id IN ({",".join("?" * len(pending))}) AND status NOT IN ({marks})
+            """, (*pending, *SUMMARY_PENDING)).fetchall()
+        for job_id, status, error in done:
+            i, job = pending.pop(job_id)
+            record(i, job, error=None if status == "succeeded" else (error or status), summary_job=job_id)
+        if pending:
+            time.sleep(0.5)
+
+# Every answer is started up front (whole-document streams on the chat pool,
+# map-reduce maps submitted to it) and then drained in job order.
+def run_chats(jobs, operator, base_dir, force_refresh, record):
+    started = []
+    for i, job in jobs:
+        try:
+            text = job_text(job, base_dir)
+            stream = copilot_answer_stream(text, job.get("question", ""), job.get("mode", "auto"), force_refresh)
+            started.append((i, job, document_hash(text), stream))
+        except Exception as e:
+            record(i, job, error=e)
+    for i, job, doc_hash, stream in started:
+        try:
+            output = "".join(stream) or "No model output returned."
+        except Exception as e:
+            record(i, job, error=e)
+            continue
+        record(i, job, scan=save_scan(operator, job_doc_id(job), "", output, job.get("context", ""), doc_hash))
+
+# Python API: run every job, each kind on its own driver thread so reports,
+# sentiment, summaries and chats all overlap. Returns one result dict per job,
+# in job order; on_result(result) is called as each one finishes.
+def run_jobs(jobs, operator="fetch", base_dir=".", force_refresh=False, on_result=None):
+    init_db()
+    results = [None] * len(jobs)
+    lock = threading.Lock()
+
+    def record(i, job, error=None, **extra):
+        result = {"job": i, "kind": job["kind"], "doc_id": job_doc_id(job),
+                  "status": "error" if error else "ok", **extra}
+        if error:
+            result["error"] = str(error)
+        with lock:
+            results[i] = result
+            if on_result:
+                on_result(result)
+
+    by_kind = {kind: [(i, job) for i, job in enumerate(jobs) if job["kind"] == kind] for kind in JOB_KINDS}
+    drivers = {
+        "report": lambda items: run_reports(items, operator, force_refresh, record),
+        "sentiment": lambda items: run_sentiments(items, operator, base_dir, record),
+        "summary": lambda items: run_summaries(items, operator, base_dir, record),
+        "chat": lambda items: run_chats(items, operator, base_dir, force_refresh, record),
+    }
+    with ThreadPoolExecutor(max_workers=len(JOB_KINDS), thread_name_prefix="cyclops-jobs") as pool:
+        futures = {pool.submit(drivers[kind], items): items for kind, items in by_kind.items() if items}
+        for fut in as_completed(futures):
+            try:
+                fut.result()
+            except Exception as e:
+                for i, job in futures[fut]:
+                    if results[i] is None:
+                        record(i, job, error=e)
+    return results
+
+def parse_limits(pairs, cast):
+    out = {}
+    for pair in pairs or []:
+        name, _, value = pair.partition("=")
+        if name not in ENDPOINT_LIMITS or not value:
+            raise argparse.ArgumentTypeError(f"Expected ENDPOINT=VALUE with ENDPOINT in {', '.join(ENDPOINT_LIMITS)}")
+        out[name] = cast(value)
+    return out
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("jobs", help="job file (JSON lines or a JSON list)")
+    ap.add_argument("--operator", default="fetch", help="operator recorded on every saved scan")
+    ap.add_argument("--db", default=store.DB_FILE, help="SQLite database (default: %(default)s)")
+    ap.add_argument("--workers", nargs="*", metavar="ENDPOINT=N", help="max concurrent calls per endpoint")
+    ap.add_argument("--rate", nargs="*", metavar="ENDPOINT=R", help="max requests per second per endpoint")
+    ap.add_argument("--refresh", action="store_true", help="bypass the SERP/LLM response caches")
+    ap.add_argument("--out", help="also write one JSON result per line to this file")
+    args = ap.parse_args(argv)
+
+    try:
+        limits, rates = parse_limits(args.workers, int), parse_limits(args.rate, float)
+    except argparse.ArgumentTypeError as e:
+        ap.error(str(e))
+    engine.configure(limits, rates)
+    store.configure(args.db)
+
+    jobs = load_jobs(args.jobs)
+    out = open(args.out, "w", encoding="utf-8") if args.out else None
+    start = time.perf_counter()
+
+    def report(result):
+        status = result["status"] if result["status"] == "ok" else f"error: {result['error']}"
+        print(f"[{result['job']}] {result['kind']} {result['doc_id']}: {status}", flush=True)
+        if out:
+            out.write(json.dumps(result, ensure_ascii=False) + "\n")
+            out.flush()
+
+    try:
+        results = run_jobs(jobs, operator=args.operator, base_dir=Path(args.jobs).parent,
+                           force_refresh=args.refresh, on_result=report)
+    finally:
+        if out:
+            out.close()
+    failed = sum(r["status"] != "ok" for r in results)
+    print(f"{len(results) - failed}/{len(results)} jobs saved to {store.DB_FILE} in {time.perf_counter() - start:.1f}s")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,14 +1,30 @@
 import streamlit as st
 import pandas as pd
-import sqlite3
 import pickle
+import atexit
+import json
+import logging
+import os
+import tempfile
+import threading
+from contextlib import closing
 from pathlib import Path
 import numpy as np
+import db
+import sqf_ann
 
 # =============================
 # CONFIG
 # =============================
 DB_PATH = "tonga_sqf_vectors.db"
+INGEST_CHUNK_SIZE = 1000
+TEXT_PAGE_SIZE = 50
+ANN_NPROBE = 8
+ANN_SAVE_DELAY = 30  # seconds; index changes within the window share one save
+EXPORT_CHUNK_SIZE = 5000
+VECTOR_DIM = 10
+VECTOR_DTYPE = np.float32
+log = logging.getLogger(__name__)
 st.set_page_config("Tonga SQF Semantic Search", layout="wide")
 
 # =============================
@@ -60,7 +76,7 @@ PARTICLE_IDX = {k:i for i,k in enumerate(SQF_PARTICLE_CLASSES.keys())}
 # =============================
 # VECTOR GENERATOR
 # =============================
-def sqf_vector(particle_type, particle_class):
+def compute_sqf_vector(particle_type, particle_class):
     vector = np.zeros(10)
     vector[0] = PARTICLE_IDX.get(particle_type, PARTICLE_IDX["Unknown"])
     class_list = SQF_PARTICLE_CLASSES.get(particle_type, ["Unknown"])
@@ -76,46 +92,449 @@ def sqf_vector(particle_type, particle_class):
     vector[9] = 0
     return vector.tolist()
 
+# The vector only depends on the (particle, class) pair, so every pair is
+# computed once at import time and enrichment becomes a table lookup.
+SQF_CLASSES = list(dict.fromkeys(
+    [c for classes in SQF_PARTICLE_CLASSES.values() for c in classes] + list(SubclassSemanticMatrix)
+))
+CLASS_IDX = {k:i for i,k in enumerate(SQF_CLASSES)}
+SQF_TABLE = np.array(
+    [[compute_sqf_vector(p, c) for c in SQF_CLASSES] for p in PARTICLE_IDX],
+    dtype=VECTOR_DTYPE
+)
+SQF_TABLE.setflags(write=False)
+
+def sqf_vector(particle_type, particle_class):
+    ti = PARTICLE_IDX.get(particle_type, PARTICLE_IDX["Unknown"])
+    ci = CLASS_IDX.get(particle_class, CLASS_IDX["Unknown"])
+    return SQF_TABLE[ti, ci].tolist()
+
+# Vectorized enrichment: (len(df), VECTOR_DIM) matrix for the sqf_particle /
+# particle_class columns of df, missing columns and values treated as "Unknown".
+def sqf_vectors(df):
+    def lookup(col, index):
+        if col not in df:
+            return np.full(len(df), index["Unknown"], dtype=np.intp)
+        return df[col].map(index).fillna(index["Unknown"]).to_numpy(dtype=np.intp)
+    return SQF_TABLE[lookup("sqf_particle", PARTICLE_IDX), lookup("particle_class", CLASS_IDX)]
+
+# =============================
+# VECTOR STORAGE
+# =============================
+# Vectors are stored as packed little-endian float32 BLOBs (VECTOR_DIM * 4 bytes).
+def pack_vector(vec):
+    return np.asarray(vec, dtype="<f4").reshape(VECTOR_DIM).tobytes()
+
+# Decode an iterable of vector BLOBs into one contiguous (n, VECTOR_DIM) matrix.
+def unpack_vectors(blobs):
+    blobs = list(blobs)
+    if not blobs:
+        return np.empty((0, VECTOR_DIM), dtype=VECTOR_DTYPE)
+    buf = b"".join(blobs)
+    return np.frombuffer(buf, dtype="<f4").reshape(len(blobs), VECTOR_DIM).astype(VECTOR_DTYPE, copy=False)
+
+# Per-row vectors for display and export; NULL BLOBs come back as None.
+def unpack_optional(blobs):
+    blobs = list(blobs)
+    vectors = iter(unpack_vectors(b for b in blobs if b is not None))
+    return [next(vectors) if b is not None else None for b in blobs]
+
 # =============================
 # DATABASE HELPERS
 # =============================
+# Pooled connections from db.py (WAL + tuned pragmas, autocommit).
 def get_conn():
-    return sqlite3.connect(DB_PATH, check_same_thread=False)
+    return db.get_pool(DB_PATH).connection()
+
+def transaction():
+    return db.get_pool(DB_PATH).transaction()
 
 def init_db():
-    conn = get_conn()
+    with get_conn() as conn:
+        init_schema(conn)
+
+# Rows are keyed by an explicit id, which VACUUM never renumbers; the FTS
+# tables and the IVF index refer to rows by it.
+VOCAB_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS {table} (
+        id INTEGER PRIMARY KEY,
+        tonga_word TEXT UNIQUE,
+        comment TEXT,
+        pos TEXT,
+        sqf_particle TEXT,
+        particle_class TEXT,
+        vector BLOB
+    )
+"""
+
+def init_schema(conn):
     cur = conn.cursor()
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS vocab (
-            tonga_word TEXT,
-            comment TEXT,
-            pos TEXT,
-            sqf_particle TEXT,
-            particle_class TEXT,
-            vector TEXT,
-            PRIMARY KEY(tonga_word)
-        )
+    cur.execute(VOCAB_TABLE_SQL.format(table="vocab"))
+    migrate_vocab_ids(conn)
+    migrate_vectors(conn)
+    init_fts(conn)
+
+# Tables created before vocab had an id are rebuilt with id = the old rowid,
+# so persisted IVF indexes stay valid. The FTS tables (keyed on the implicit
+# rowid) are dropped and rebuilt by init_fts.
+def migrate_vocab_ids(conn):
+    if "id" in [c[1] for c in conn.execute("PRAGMA table_info(vocab)")]:
+        return False
+    conn.executescript(f"""
+        BEGIN;
+        DROP TABLE IF EXISTS vocab_fts;
+        DROP TABLE IF EXISTS vocab_trigram;
+        {VOCAB_TABLE_SQL.format(table="vocab_new")};
+        INSERT INTO vocab_new (id, tonga_word, comment, pos, sqf_particle, particle_class, vector)
+            SELECT rowid, tonga_word, comment, pos, sqf_particle, particle_class, vector FROM vocab;
+        DROP TABLE vocab;
+        ALTER TABLE vocab_new RENAME TO vocab;
+        COMMIT;
     """)
-    conn.commit()
-    conn.close()
+    return True
 
-def insert_row(row):
-    conn = get_conn()
+# =============================
+# FULL-TEXT INDEX
+# =============================
+# vocab_fts (unicode61 words, prefix-indexed) serves prefix and BM25 queries,
+# vocab_trigram serves substring queries. Both are external-content tables
+# over vocab and kept in sync by triggers.
+FTS_TABLES = {
+    "vocab_fts": "tokenize='unicode61 remove_diacritics 2', prefix='2 3'",
+    "vocab_trigram": "tokenize='trigram'",
+}
+
+def init_fts(conn):
+    cur = conn.cursor()
+    existing = {r[0] for r in cur.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'trigger')")}
+    for name, options in FTS_TABLES.items():
+        if name in existing:
+            continue
+        cur.executescript(f"""
+            CREATE VIRTUAL TABLE {name} USING fts5(
+                tonga_word, comment, content='vocab', content_rowid='id', {options}
+            );
+            CREATE TRIGGER {name}_ai AFTER INSERT ON vocab BEGIN
+                INSERT INTO {name}(rowid, tonga_word, comment) VALUES (new.id, new.tonga_word, new.comment);
+            END;
+            CREATE TRIGGER {name}_ad AFTER DELETE ON vocab BEGIN
+                INSERT INTO {name}({name}, rowid, tonga_word, comment) VALUES ('delete', old.id, old.tonga_word, old.comment);
+            END;
+            CREATE TRIGGER {name}_au AFTER UPDATE ON vocab BEGIN
+                INSERT INTO {name}({name}, rowid, tonga_word, comment) VALUES ('delete', old.id, old.tonga_word, old.comment);
+                INSERT INTO {name}(rowid, tonga_word, comment) VALUES (new.id, new.tonga_word, new.comment);
+            END;
+            INSERT INTO {name}({name}) VALUES ('rebuild');
+        """)
+
+def fts_terms(query):
+    return ['"' + t.replace('"', '""') + '"' for t in query.split()]
+
+# Page through vocab rows matching query. mode is "substring" (the original
+# LIKE behaviour), "prefix" or "ranked" (BM25 over whole words); order is
+# "rank" or "word".
+# Returns (page DataFrame, total match count).
+def search_text(query, mode="substring", order="rank", limit=TEXT_PAGE_SIZE, offset=0):
+    query = query.strip()
+    if not query:
+        return pd.DataFrame(), 0
+    if mode == "substring" and len(query) < 3:
+        # trigram index needs at least three characters; fall back to a scan
+        where = "(v.tonga_word LIKE ? ESCAPE '!' OR v.comment LIKE ? ESCAPE '!')"
+        pattern = "%" + query.replace("!", "!!").replace("%", "!%").replace("_", "!_") + "%"
+        source, params, rank = "vocab v", [pattern, pattern], "v.tonga_word"
+    else:
+        if mode == "substring":
+            table, match = "vocab_trigram", '"' + query.replace('"', '""') + '"'
+        elif mode == "prefix":
+            table, match = "vocab_fts", " ".join(t + "*" for t in fts_terms(query))
+        elif mode == "ranked":
+            table, match = "vocab_fts", " ".join(fts_terms(query))
+        else:
+            raise ValueError(f"Unknown search mode: {mode}")
+        source = f"{table} f JOIN vocab v ON v.id = f.rowid"
+        where, params = f"{table} MATCH ?", [match]
+        rank = f"bm25({table}, 2.0, 1.0)"
+    order_by = rank if order == "rank" else "v.tonga_word"
+    with get_conn() as conn:
+        total = conn.execute(f"SELECT count(*) FROM {source} WHERE {where}", params).fetchone()[0]
+        df = pd.read_sql(
+            f"SELECT v.id, v.tonga_word, v.comment, v.pos, v.sqf_particle, v.particle_class "
+            f"FROM {source} WHERE {where} ORDER BY {order_by} LIMIT ? OFFSET ?",
+            conn, params=params + [limit, offset]
+        )
+    return df.set_index("id"), total
+
+# Convert legacy str(list) vectors to packed float32 BLOBs in place. A vector
+# that does not parse is recomputed from the row's particle and class, and
+# logged, rather than stored as a meaningless zero vector.
+def migrate_vectors(conn):
     cur = conn.cursor()
-    cur.execute("""
-        INSERT OR REPLACE INTO vocab
-        (tonga_word, comment, pos, sqf_particle, particle_class, vector)
-        VALUES (?,?,?,?,?,?)
-    """,(row["tonga_word"], row["comment"], row["pos"], row["sqf_particle"], row["particle_class"], str(row["vector"])))
-    conn.commit()
-    conn.close()
+    rows = cur.execute("""
+        SELECT id, tonga_word, sqf_particle, particle_class, vector FROM vocab WHERE typeof(vector) = 'text'
+    """).fetchall()
+    if not rows:
+        return 0
+    updates, recomputed = [], []
+    for row_id, word, particle, particle_class, text in rows:
+        try:
+            blob = pack_vector(json.loads(text))
+        except (ValueError, TypeError):
+            blob = pack_vector(sqf_vector(particle, particle_class))
+            recomputed.append(word)
+        updates.append((blob, row_id))
+    if recomputed:
+        log.warning("Recomputed %d unparseable legacy vectors from their SQF class: %s",
+                    len(recomputed), ", ".join(map(str, recomputed[:20])))
+    cur.execute("BEGIN")
+    cur.executemany("UPDATE vocab SET vector = ? WHERE id = ?", updates)
+    cur.execute("COMMIT")
+    return len(updates)
+
+# Upsert rather than INSERT OR REPLACE: REPLACE deletes without firing the
+# FTS delete triggers and would also give the row a new id.
+INSERT_VOCAB_SQL = """
+    INSERT INTO vocab
+    (tonga_word, comment, pos, sqf_particle, particle_class, vector)
+    VALUES (?,?,?,?,?,?)
+    ON CONFLICT(tonga_word) DO UPDATE SET
+        comment = excluded.comment,
+        pos = excluded.pos,
+        sqf_particle = excluded.sqf_particle,
+        particle_class = excluded.particle_class,
+        vector = excluded.vector
+"""
+
+def vocab_params(row):
+    return (row["tonga_word"], row["comment"], row["pos"], row["sqf_particle"], row["particle_class"], pack_vector(row["vector"]))
+
+def insert_row(row):
+    with get_conn() as conn:
+        conn.execute(INSERT_VOCAB_SQL, vocab_params(row))
+    vocab_changed([row["tonga_word"]])
+
+# Bulk ingest over one connection and one transaction. Each chunk runs inside
+# its own SAVEPOINT so a corrupt row only rolls back its chunk.
+# Returns (saved_count, [(first_index, last_index, error), ...]).
+def insert_rows(rows, chunk_size=INGEST_CHUNK_SIZE, progress=None):
+    rows = list(rows)
+    saved, failed, words = 0, [], []
+    with transaction() as conn:
+        cur = conn.cursor()
+        for start in range(0, len(rows), chunk_size):
+            chunk = rows[start:start + chunk_size]
+            cur.execute("SAVEPOINT chunk")
+            try:
+                cur.executemany(INSERT_VOCAB_SQL, [vocab_params(r) for r in chunk])
+            except Exception as e:
+                cur.execute("ROLLBACK TO chunk")
+                failed.append((start, start + len(chunk) - 1, str(e)))
+            else:
+                saved += len(chunk)
+                words.extend(r["tonga_word"] for r in chunk)
+            cur.execute("RELEASE chunk")
+            if progress:
+                progress(min(start + chunk_size, len(rows)), len(rows))
+    vocab_changed(words)
+    return saved, failed
 
 def fetch_all():
-    conn = get_conn()
-    df = pd.read_sql("SELECT * FROM vocab ORDER BY tonga_word",conn)
-    conn.close()
+    with get_conn() as conn:
+        df = pd.read_sql("SELECT * FROM vocab ORDER BY tonga_word",conn)
+    df["vector"] = unpack_optional(df["vector"])
     return df
 
+# Return (ids, matrix) for the whole vocab table with no per-row parsing.
+# Rows without a vector are left out of the search structures.
+def load_vectors():
+    with get_conn() as conn:
+        rows = conn.execute("SELECT id, vector FROM vocab WHERE vector IS NOT NULL ORDER BY id").fetchall()
+    ids = np.fromiter((r[0] for r in rows), dtype=np.int64, count=len(rows))
+    return ids, unpack_vectors(r[1] for r in rows)
+
+def load_vectors_for_words(words, batch=500):
+    words = list(words)
+    rows = []
+    with get_conn() as conn:
+        for start in range(0, len(words), batch):
+            part = words[start:start + batch]
+            marks = ",".join("?" * len(part))
+            rows += conn.execute(f"SELECT id, vector FROM vocab WHERE tonga_word IN ({marks}) AND vector IS NOT NULL",
+                                 part).fetchall()
+    ids = np.fromiter((r[0] for r in rows), dtype=np.int64, count=len(rows))
+    return ids, unpack_vectors(r[1] for r in rows)
+
+def fetch_rows(ids):
+    ids = [int(i) for i in ids]
+    if not ids:
+        return pd.DataFrame()
+    marks = ",".join("?" * len(ids))
+    with get_conn() as conn:
+        df = pd.read_sql(f"SELECT * FROM vocab WHERE id IN ({marks})", conn, params=ids)
+    df["vector"] = unpack_optional(df["vector"])
+    return df.set_index("id").reindex(ids)
+
+# =============================
+# VECTOR SEARCH ENGINE
+# =============================
+SEARCH_METRICS = sqf_ann.METRICS
+DEFAULT_METRIC = "dot"  # the original search scored by plain dot product
+
+# Held once per process; insert_row clears it so the next search reloads the table.
+@st.cache_resource
+def load_search_matrix():
+    ids, matrix = load_vectors()
+    sq_norms = np.einsum("ij,ij->i", matrix, matrix)
+    return ids, matrix, sq_norms
+
+# Score every row against a batch of queries with one matrix product and
+# return (ids, scores), each shaped (n_queries, k) and best-first.
+# For "l2" the score is the Euclidean distance (lower is better).
+def topk_search(queries, k=20, metric=DEFAULT_METRIC):
+    if metric not in SEARCH_METRICS:
+        raise ValueError(f"Unknown metric: {metric}")
+    ids, matrix, sq_norms = load_search_matrix()
+    queries = np.atleast_2d(np.asarray(queries, dtype=VECTOR_DTYPE))
+    if queries.shape[1] != VECTOR_DIM:
+        raise ValueError(f"Query vectors must have {VECTOR_DIM} dimensions")
+    return sqf_ann.exact_search(ids, matrix, queries, k=k, metric=metric, sq_norms=sq_norms)
+
+# =============================
+# APPROXIMATE (IVF) INDEX
+# =============================
+# One IVF index per metric, persisted next to the database, e.g.
+# tonga_sqf_vectors.cosine.ivf.npz.
+def ann_path(metric):
+    return Path(DB_PATH).with_suffix(f".{metric}.ivf.npz")
+
+# Rows the index should hold (rows without a vector are never indexed).
+def vocab_count():
+    with get_conn() as conn:
+        return conn.execute("SELECT count(*) FROM vocab WHERE vector IS NOT NULL").fetchone()[0]
+
+# Indexes with changes not yet written to disk, by metric. Saves rewrite the
+# whole file, so they are batched: the first change schedules a save
+# ANN_SAVE_DELAY seconds later and the changes in between ride along. An
+# index left unsaved at exit fails the size check in load_ann_index and is
+# rebuilt.
+ANN_UNSAVED = {}
+ANN_SAVE_LOCK = threading.Lock()
+
+def flush_ann_index(metric):
+    with ANN_SAVE_LOCK:
+        index = ANN_UNSAVED.pop(metric, None)
+        if index is not None:
+            index.save(ann_path(metric))
+
+def schedule_ann_save(metric, index):
+    with ANN_SAVE_LOCK:
+        scheduled = metric in ANN_UNSAVED
+        ANN_UNSAVED[metric] = index
+    if not scheduled:
+        timer = threading.Timer(ANN_SAVE_DELAY, flush_ann_index, args=(metric,))
+        timer.daemon = True
+        timer.start()
+
+@atexit.register
+def flush_ann_indexes():
+    for metric in list(ANN_UNSAVED):
+        flush_ann_index(metric)
+
+def build_ann_index(metric):
+    ids, matrix = load_vectors()
+    index = sqf_ann.IVFIndex.build(ids, matrix, metric=metric, nprobe=ANN_NPROBE)
+    with ANN_SAVE_LOCK:
+        ANN_UNSAVED.pop(metric, None)  # a pending save of the old index must not overwrite this one
+        index.save(ann_path(metric))
+    return index
+
+# Loaded from disk when it is in step with the table, rebuilt otherwise.
+@st.cache_resource
+def load_ann_index(metric):
+    path = ann_path(metric)
+    if path.exists():
+        index = sqf_ann.IVFIndex.load(path)
+        if len(index) == vocab_count() and not index.needs_retrain():
+            return index
+    return build_ann_index(metric)
+
+def ann_search(queries, k=20, metric=DEFAULT_METRIC, nprobe=ANN_NPROBE):
+    queries = np.atleast_2d(np.asarray(queries, dtype=VECTOR_DTYPE))
+    return load_ann_index(metric).search(queries, k=k, nprobe=nprobe)
+
+# Called after every write to vocab: drops the exact-search cache and folds
+# the changed rows into any persisted IVF index. IVFIndex.add is incremental
+# and publishes its new state atomically, so searches in other sessions keep
+# running against the shared index; the file is rewritten by a batched save.
+def vocab_changed(words):
+    load_search_matrix.clear()
+    if not words:
+        return
+    ids, matrix = load_vectors_for_words(words)
+    for metric in SEARCH_METRICS:
+        if not ann_path(metric).exists():
+            continue
+        index = load_ann_index(metric)
+        index.add(ids, matrix)
+        if index.needs_retrain():
+            load_ann_index.clear()
+            build_ann_index(metric)
+        else:
+            schedule_ann_save(metric, index)
+
+# =============================
+# STREAMING EXPORT
+# =============================
+VOCAB_COLUMNS = ["tonga_word", "comment", "pos", "sqf_particle", "particle_class", "vector"]
+
+# Yield vocab rows as dicts, reading the cursor chunk by chunk. The pooled
+# connection is held until the generator finishes, so callers wrap it in
+# closing() to hand it back even when they stop early or fail mid-write.
+def iter_vocab(chunk_size=EXPORT_CHUNK_SIZE):
+    with get_conn() as conn:
+        cur = conn.execute(f"SELECT {', '.join(VOCAB_COLUMNS)} FROM vocab ORDER BY tonga_word")
+        while True:
+            chunk = cur.fetchmany(chunk_size)
+            if not chunk:
+                break
+            vectors = [v.tolist() if v is not None else None for v in unpack_optional(r[5] for r in chunk)]
+            for r, vec in zip(chunk, vectors):
+                yield dict(zip(VOCAB_COLUMNS, r[:5] + (vec,)))
+
+# Pickles as a plain list, but the items are pulled from the iterator and
+# written in batched APPENDS frames, so the list never exists in memory.
+class StreamedList:
+    def __init__(self, items):
+        self.items = items
+
+    def __reduce__(self):
+        return (list, (), None, self.items)
+
+def write_pickle_export(f):
+    pickler = pickle.Pickler(f, protocol=5)
+    pickler.fast = True  # no memo: rows are not retained after they are written
+    with closing(iter_vocab()) as rows:
+        pickler.dump(StreamedList(rows))
+
+def write_jsonl_export(f):
+    with closing(iter_vocab()) as rows:
+        for row in rows:
+            f.write(json.dumps(row, ensure_ascii=False).encode("utf-8"))
+            f.write(b"\n")
+
+EXPORT_FORMATS = {
+    "Pickle": (write_pickle_export, "tonga_sqf_enriched.pkl", "application/octet-stream"),
+    "JSONL": (write_jsonl_export, "tonga_sqf_enriched.jsonl", "application/x-ndjson"),
+}
+
+# Write the export to a temp file and return its path; the caller removes it.
+def export_to_file(fmt):
+    writer, file_name, _ = EXPORT_FORMATS[fmt]
+    fd, path = tempfile.mkstemp(suffix=Path(file_name).suffix)
+    with os.fdopen(fd, "wb") as f:
+        writer(f)
+    return path
+
 init_db()
 
 # =============================
@@ -132,17 +551,31 @@ with tab1:
     st.subheader("Upload Pickle")
     uploaded = st.file_uploader("Pickle file (.pkl) containing Tonga lexicon", type=["pkl"])
     if uploaded:
-        data = pickle.load(uploaded)
-        st.write(f"Loaded {len(data)} entries.")
-        enriched = []
-        for row in data:
-            particle_type = row.get("sqf_particle","Unknown")
-            particle_class = row.get("particle_class","Unknown")
-            row["vector"] = sqf_vector(particle_type, particle_class)
-            enriched.append(row)
-            insert_row(row)
-        st.success(f"Enriched and saved {len(enriched)} entries to SQLite.")
-        st.dataframe(pd.DataFrame(enriched).head(20))
+        chunk_size = st.number_input("Rows per transaction chunk", min_value=1, value=INGEST_CHUNK_SIZE, step=100)
+        # Ingest only on click: other widgets rerun the script with the file
+        # still in the uploader, and a re-ingest would also reset the search
+        # caches. The outcome is kept in session state for later reruns.
+        if st.button("Enrich & Save"):
+            uploaded.seek(0)
+            data = pickle.load(uploaded)
+            enriched = list(data)
+            for row, vec in zip(enriched, sqf_vectors(pd.DataFrame(enriched))):
+                row["vector"] = vec
+            bar = st.progress(0.0, text="Saving to SQLite...")
+            saved, failed = insert_rows(
+                enriched,
+                chunk_size=int(chunk_size),
+                progress=lambda done, total: bar.progress(done / total, text=f"Saved {done}/{total}")
+            )
+            st.session_state.ingest = {"file_id": uploaded.file_id, "loaded": len(enriched), "saved": saved,
+                                       "failed": failed, "preview": pd.DataFrame(enriched).head(20)}
+        ingest = st.session_state.get("ingest")
+        if ingest and ingest["file_id"] == uploaded.file_id:
+            st.write(f"Loaded {ingest['loaded']} entries.")
+            st.success(f"Enriched and saved {ingest['saved']} entries to SQLite.")
+            for first, last, err in ingest["failed"]:
+                st.error(f"Rows {first}-{last} skipped: {err}")
+            st.dataframe(ingest["preview"])
 
 # -----------------------------
 # TAB 2 — Search
@@ -150,37 +583,64 @@ with tab1:
 with tab2:
     st.subheader("Search Tonga or English comment")
     query = st.text_input("Search by word or comment substring")
+    col_mode, col_order = st.columns(2)
+    text_mode = col_mode.selectbox("Match", ["substring", "prefix", "ranked"])
+    text_order = col_order.radio("Order by", ["rank", "word"], horizontal=True)
     if st.button("Search Text"):
-        df = fetch_all()
-        mask = df.apply(lambda r: query.lower() in str(r["tonga_word"]).lower() or query.lower() in str(r["comment"]).lower(), axis=1)
-        st.dataframe(df[mask])
+        if st.session_state.get("text_search") != (query, text_mode, text_order):
+            st.session_state.pop("text_page", None)  # a new search starts on page 1
+        st.session_state.text_search = (query, text_mode, text_order)
+    if st.session_state.get("text_search"):
+        q, m, o = st.session_state.text_search
+        page = st.number_input("Page", min_value=1, value=1, key="text_page")
+        df, total = search_text(q, mode=m, order=o, offset=(page - 1) * TEXT_PAGE_SIZE)
+        st.caption(f"{total} matches — page {page} of {max(1, -(-total // TEXT_PAGE_SIZE))}")
+        st.dataframe(df)
 
     st.subheader("Vector Search")
-    vector_input = st.text_area("Enter 10-dim vector (comma-separated)")
+    vector_input = st.text_area("Enter 10-dim vector (comma-separated, one query per line)")
+    col_metric, col_k, col_ann = st.columns(3)
+    metric = col_metric.selectbox("Metric", SEARCH_METRICS, index=SEARCH_METRICS.index(DEFAULT_METRIC))
+    top_k = col_k.number_input("Top k", min_value=1, max_value=1000, value=20)
+    use_ann = col_ann.checkbox("Approximate (IVF index)")
+    nprobe = st.slider("IVF buckets probed (higher = better recall, slower)", 1, 256, ANN_NPROBE, disabled=not use_ann)
     if st.button("Search Vector"):
         try:
-            qvec = np.array([float(x) for x in vector_input.strip().split(",")])
-            df = fetch_all()
-            vectors = df["vector"].apply(lambda s: np.array(eval(s)))
-            dot_scores = vectors.apply(lambda v: np.dot(qvec,v))
-            df["score"] = dot_scores
-            st.dataframe(df.sort_values("score",ascending=False).head(20))
-        except:
+            lines = [l for l in vector_input.strip().splitlines() if l.strip()]
+            qvecs = np.array([[float(x) for x in l.split(",")] for l in lines], dtype=VECTOR_DTYPE)
+            if use_ann:
+                ids, scores = ann_search(qvecs, k=int(top_k), metric=metric, nprobe=nprobe)
+            else:
+                ids, scores = topk_search(qvecs, k=int(top_k), metric=metric)
+        except ValueError:
             st.error("Invalid vector input. Enter 10 numbers separated by commas.")
+        else:
+            score_col = "distance" if metric == "l2" else "score"
+            for qi, line in enumerate(lines):
+                found = ids[qi] >= 0
+                df = fetch_rows(ids[qi][found])
+                df[score_col] = scores[qi][found]
+                if len(lines) > 1:
+                    st.caption(f"Query {qi + 1}: {line}")
+                st.dataframe(df)
 
 # -----------------------------
 # TAB 3 — Export Pickle
 # -----------------------------
 with tab3:
     st.subheader("Generate & Download Enriched Pickle")
+    export_fmt = st.radio("Format", list(EXPORT_FORMATS), horizontal=True)
     if st.button("Generate Pickle"):
-        df = fetch_all()
-        enriched_list = df.to_dict(orient="records")
-        pickle_bytes = pickle.dumps(enriched_list)
-        st.download_button(
-            "Download Enriched Pickle",
-            data=pickle_bytes,
-            file_name="tonga_sqf_enriched.pkl",
-            mime="application/octet-stream"
-        )
-        st.success("Pickle ready for download.")
\ No newline at end of file
+        _, file_name, mime = EXPORT_FORMATS[export_fmt]
+        path = export_to_file(export_fmt)
+        try:
+            with open(path, "rb") as f:
+                st.download_button(
+                    f"Download Enriched {export_fmt}",
+                    data=f,
+                    file_name=file_name,
+                    mime=mime
+                )
+        finally:
+            os.remove(path)
+        st.success(f"{export_fmt} ready for download.")
\ No newline at end of file
@@ -0,0 +1,259 @@
+import os
+import threading
+from collections import namedtuple
+import numpy as np
+
+# =============================
+# Scoring helpers (shared with lsg.topk_search)
+# =============================
+METRICS = ["cosine", "dot", "l2"]
+
+# Scores shaped (n_queries, n_rows) where higher is always better
+# ("l2" is returned as negative distance).
+def score(queries, matrix, metric, sq_norms=None):
+    if metric not in METRICS:
+        raise ValueError(f"Unknown metric: {metric}")
+    if sq_norms is None:
+        sq_norms = np.einsum("ij,ij->i", matrix, matrix)
+    scores = queries @ matrix.T
+    if metric == "cosine":
+        q_norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        denom = q_norms * np.sqrt(sq_norms)[None, :]
+        scores = np.divide(scores, denom, out=np.zeros_like(scores), where=denom > 0)
+    elif metric == "l2":
+        q_sq = np.einsum("ij,ij->i", queries, queries)[:, None]
+        scores = -np.sqrt(np.maximum(q_sq - 2 * scores + sq_norms[None, :], 0))
+    return scores
+
+# Best-first (positions, scores) of the k highest scores in every row.
+def select_topk(scores, k):
+    n = scores.shape[1]
+    k = min(k, n)
+    if k < n:
+        part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        part = np.tile(np.arange(n), (len(scores), 1))
+    part_scores = np.take_along_axis(scores, part, axis=1)
+    order = np.argsort(-part_scores, axis=1, kind="stable")
+    return np.take_along_axis(part, order, axis=1), np.take_along_axis(part_scores, order, axis=1)
+
+# Brute-force search: (ids, scores) shaped (n_queries, k); "l2" scores are distances.
+def exact_search(ids, matrix, queries, k=20, metric="cosine", sq_norms=None):
+    queries = np.atleast_2d(np.asarray(queries, dtype=matrix.dtype))
+    if len(ids) == 0:
+        empty = np.empty((len(queries), 0))
+        return empty.astype(np.int64), empty
+    pos, top = select_topk(score(queries, matrix, metric, sq_norms), k)
+    if metric == "l2":
+        top = -top
+    return ids[pos], top
+
+# =============================
+# IVF index
+# =============================
+EMPTY_IDS = np.empty(0, dtype=np.int64)
+
+# Immutable view of an IVFIndex: centroids, bucketed rows stored contiguously
+# per list (offsets[l]:offsets[l + 1]), ids of bucketed rows since removed or
+# replaced, and a small unbucketed delta of recent adds. Writers publish a
+# new state in one assignment, so a concurrent search always sees one
+# consistent index.
+IVFState = namedtuple(
+    "IVFState", "centroids ids vectors lists offsets sorted_ids dead delta_ids delta_vectors delta_lists"
+)
+
+# Inverted-file index: rows are bucketed under k-means centroids and a query
+# only scores the rows of its `nprobe` closest buckets (plus the delta).
+# nprobe is the recall-vs-latency knob (nprobe == nlist is an exact search).
+class IVFIndex:
+    ASSIGN_BATCH = 65536
+    DELTA_MIN = 1024        # adds buffered before they are merged into the buckets...
+    DELTA_FRACTION = 0.05   # ...or this share of the index, whichever is larger
+
+    def __init__(self, dim, nlist=None, metric="cosine", nprobe=8):
+        if metric not in METRICS:
+            raise ValueError(f"Unknown metric: {metric}")
+        self.dim = dim
+        self.nlist = nlist
+        self.metric = metric
+        self.nprobe = nprobe
+        self.trained_size = 0
+        self.lock = threading.Lock()
+        self.state = self._bucketed(np.empty((0, dim), dtype=np.float32), EMPTY_IDS,
+                                    np.empty((0, dim), dtype=np.float32), np.empty(0, dtype=np.int32))
+
+    def __len__(self):
+        s = self.state
+        return len(s.ids) - len(s.dead) + len(s.delta_ids)
+
+    @property
+    def centroids(self):
+        return self.state.centroids
+
+    @classmethod
+    def build(cls, ids, matrix, nlist=None, metric="cosine", nprobe=8, iters=10, seed=0):
+        index = cls(matrix.shape[1], nlist=nlist, metric=metric, nprobe=nprobe)
+        index.train(matrix, iters=iters, seed=seed)
+        index.add(ids, matrix)
+        return index
+
+    # Cosine is served as inner product over unit vectors.
+    def _prepare(self, vectors):
+        vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+        if vectors.shape[1] != self.dim:
+            raise ValueError(f"Vectors must have {self.dim} dimensions")
+        if self.metric == "cosine":
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            vectors = np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 0)
+        return vectors
+
+    def _centroid_scores(self, vectors, centroids):
+        metric = "l2" if self.metric == "l2" else "dot"
+        return score(vectors, centroids, metric)
+
+    def _assign(self, vectors, centroids):
+        out = np.empty(len(vectors), dtype=np.int32)
+        for start in range(0, len(vectors), self.ASSIGN_BATCH):
+            batch = vectors[start:start + self.ASSIGN_BATCH]
+            out[start:start + len(batch)] = self._centroid_scores(batch, centroids).argmax(axis=1)
+        return out
+
+    # A state with every row bucketed (sorted by list) and an empty delta.
+    def _bucketed(self, centroids, ids, vectors, lists):
+        order = np.argsort(lists, kind="stable")
+        counts = np.bincount(lists, minlength=len(centroids))
+        return IVFState(
+            centroids, ids[order], vectors[order], lists[order], np.concatenate([[0], np.cumsum(counts)]),
+            np.sort(ids), EMPTY_IDS, EMPTY_IDS, np.empty((0, self.dim), dtype=np.float32),
+            np.empty(0, dtype=np.int32),
+        )
+
+    # The live rows of a state as (ids, vectors, lists), delta included.
+    def _rows(self, s):
+        alive = ~np.isin(s.ids, s.dead) if len(s.dead) else slice(None)
+        return (np.concatenate([s.ids[alive], s.delta_ids]),
+                np.concatenate([s.vectors[alive], s.delta_vectors]),
+                np.concatenate([s.lists[alive], s.delta_lists]))
+
+    def _merged(self, s):
+        return self._bucketed(s.centroids, *self._rows(s))
+
+    # s with ids dropped: delta rows are removed, bucketed rows marked dead.
+    def _without(self, s, ids):
+        keep = ~np.isin(s.delta_ids, ids)
+        pos = np.searchsorted(s.sorted_ids, ids)
+        found = pos < len(s.sorted_ids)
+        found[found] = s.sorted_ids[pos[found]] == ids[found]
+        dead = np.union1d(s.dead, ids[found]) if found.any() else s.dead
+        return s._replace(dead=dead, delta_ids=s.delta_ids[keep], delta_vectors=s.delta_vectors[keep],
+                          delta_lists=s.delta_lists[keep])
+
+    def train(self, matrix, iters=10, seed=0, sample_per_list=256):
+        data = self._prepare(matrix)
+        rng = np.random.default_rng(seed)
+        nlist = self.nlist or max(1, int(np.sqrt(len(data))))
+        nlist = min(nlist, max(1, len(data)))
+        if len(data) > nlist * sample_per_list:
+            data = data[rng.choice(len(data), nlist * sample_per_list, replace=False)]
+        centroids = data[rng.choice(len(data), nlist, replace=False)].copy() if len(data) else \
+            np.zeros((1, self.dim), dtype=np.float32)
+        for _ in range(iters if len(data) else 0):
+            assign = self._assign(data, centroids)
+            counts = np.bincount(assign, minlength=len(centroids))
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, data)
+            empty = counts == 0
+            centroids[~empty] = sums[~empty] / counts[~empty, None]
+            # reseed empty buckets from random rows
+            if empty.any():
+                centroids[empty] = data[rng.choice(len(data), int(empty.sum()))]
+            if self.metric != "l2":
+                norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+                centroids = np.divide(centroids, norms, out=centroids, where=norms > 0)
+        with self.lock:
+            ids, vectors, _ = self._rows(self.state)
+            self.state = self._bucketed(centroids, ids, vectors, self._assign(vectors, centroids))
+            self.nlist = len(centroids)
+            self.trained_size = len(matrix)
+
+    # Insert or replace rows by id. New rows land in the delta, which is merged
+    # into the buckets once it outgrows DELTA_MIN / DELTA_FRACTION, so an add
+    # costs O(delta) rather than O(index size).
+    def add(self, ids, vectors):
+        ids = np.asarray(ids, dtype=np.int64).ravel()
+        if len(ids) == 0:
+            return
+        vectors = self._prepare(vectors)
+        # the last vector wins when an id repeats within one call
+        ids, last = np.unique(ids[::-1], return_index=True)
+        vectors = vectors[::-1][last]
+        with self.lock:
+            s = self._without(self.state, ids)
+            s = s._replace(
+                delta_ids=np.concatenate([s.delta_ids, ids]),
+                delta_vectors=np.concatenate([s.delta_vectors, vectors]),
+                delta_lists=np.concatenate([s.delta_lists, self._assign(vectors, s.centroids)]),
+            )
+            if len(s.delta_ids) > max(self.DELTA_MIN, self.DELTA_FRACTION * len(s.ids)):
+                s = self._merged(s)
+            self.state = s
+
+    def remove(self, ids):
+        ids = np.asarray(ids, dtype=np.int64).ravel()
+        with self.lock:
+            self.state = self._without(self.state, ids)
+
+    # True once the index has grown far past the data its centroids were trained on.
+    def needs_retrain(self, factor=4):
+        return len(self) > factor * max(self.trained_size, 1)
+
+    # Same contract as exact_search: (ids, scores) shaped (n_queries, k),
+    # padded with id -1 / nan when the probed buckets hold fewer than k rows.
+    def search(self, queries, k=20, nprobe=None):
+        s = self.state
+        queries = self._prepare(queries)
+        nprobe = min(nprobe or self.nprobe, len(s.centroids))
+        out_ids = np.full((len(queries), k), -1, dtype=np.int64)
+        out_scores = np.full((len(queries), k), np.nan, dtype=np.float32)
+        if len(s.ids) - len(s.dead) + len(s.delta_ids) == 0:
+            return out_ids, out_scores
+        probes, _ = select_topk(self._centroid_scores(queries, s.centroids), nprobe)
+        metric = "l2" if self.metric == "l2" else "dot"
+        for qi, q in enumerate(queries):
+            spans = [slice(s.offsets[l], s.offsets[l + 1]) for l in probes[qi]]
+            cand_ids = np.concatenate([s.ids[span] for span in spans])
+            cand = np.concatenate([s.vectors[span] for span in spans])
+            if len(s.dead):
+                # a dead id may live on in the delta (replaced), which is kept
+                alive = ~np.isin(cand_ids, s.dead)
+                cand_ids, cand = cand_ids[alive], cand[alive]
+            cand_ids = np.concatenate([cand_ids, s.delta_ids])
+            cand = np.concatenate([cand, s.delta_vectors])
+            if len(cand_ids) == 0:
+                continue
+            pos, top = select_topk(score(q[None, :], cand, metric), k)
+            n = pos.shape[1]
+            out_ids[qi, :n] = cand_ids[pos[0]]
+            out_scores[qi, :n] = -top[0] if self.metric == "l2" else top[0]
+        return out_ids, out_scores
+
+    def save(self, path):
+        s = self.state
+        ids, vectors, lists = self._rows(s)
+        tmp = f"{path}.tmp"
+        with open(tmp, "wb") as f:
+            np.savez(
+                f, centroids=s.centroids, ids=ids, vectors=vectors, lists=lists,
+                meta=np.array([self.dim, len(s.centroids), self.nprobe, self.trained_size]),
+                metric=np.array(self.metric)
+            )
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            dim, nlist, nprobe, trained_size = (int(x) for x in data["meta"])
+            index = cls(dim, nlist=nlist, metric=str(data["metric"]), nprobe=nprobe)
+            index.trained_size = trained_size
+            index.state = index._bucketed(data["centroids"], data["ids"], data["vectors"], data["lists"])
+        return index
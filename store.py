@@ -0,0 +1,232 @@
+import hashlib
+import json
+import os
+import time
+import unicodedata
+import db
+
+# ---------------------------
+# Database file
+# ---------------------------
+DB_FILE = os.environ.get("CYCLOPS_DB", "inference.db")
+
+# Point every later call at another database; pools are per file (db.py), so
+# this takes effect immediately whatever was opened before.
+def configure(db_file):
+    global DB_FILE
+    DB_FILE = db_file
+
+# ---------------------------
+# Database setup
+# ---------------------------
+# Pooled per-thread connections (see db.py); sessions never share a cursor.
+def get_conn():
+    return db.get_pool(DB_FILE).connection()
+
+def transaction():
+    return db.get_pool(DB_FILE).transaction()
+
+def init_db():
+    with get_conn() as conn:
+        init_schema(conn)
+
+def init_schema(conn):
+    c = conn.cursor()
+    c.executescript("""
+    CREATE TABLE IF NOT EXISTS operators (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT UNIQUE NOT NULL,
+        password TEXT NOT NULL,
+        email TEXT
+    );
+    CREATE TABLE IF NOT EXISTS scans (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        operator TEXT,
+        input_text TEXT,
+        sentiment TEXT,
+        summary TEXT,
+        context TEXT,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE INDEX IF NOT EXISTS idx_scans_timestamp ON scans (timestamp);
+    CREATE INDEX IF NOT EXISTS idx_scans_operator_timestamp ON scans (operator, timestamp);
+    CREATE INDEX IF NOT EXISTS idx_scans_input_text ON scans (input_text);
+    CREATE TABLE IF NOT EXISTS feedback (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        scan_id INTEGER,
+        feedback_text TEXT,
+        rating INTEGER,
+        FOREIGN KEY (scan_id) REFERENCES scans (id)
+    );
+    CREATE TABLE IF NOT EXISTS api_cache (
+        namespace TEXT NOT NULL,
+        key TEXT NOT NULL,
+        value TEXT NOT NULL,
+        created_at REAL NOT NULL,
+        last_used REAL NOT NULL,
+        PRIMARY KEY (namespace, key)
+    );
+    CREATE INDEX IF NOT EXISTS idx_api_cache_lru ON api_cache (namespace, last_used);
+    CREATE TABLE IF NOT EXISTS summary_jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        operator TEXT,
+        doc_name TEXT,
+        context TEXT,
+        operation_location TEXT,
+        status TEXT,
+        tasks_completed INTEGER DEFAULT 0,
+        tasks_total INTEGER DEFAULT 1,
+        result TEXT,
+        error TEXT,
+        poll_interval REAL,
+        next_poll_at REAL,
+        submitted_at REAL,
+        updated_at REAL
+    );
+    CREATE INDEX IF NOT EXISTS idx_summary_jobs_status ON summary_jobs (status, next_poll_at);
+    CREATE INDEX IF NOT EXISTS idx_summary_jobs_operator ON summary_jobs (operator, submitted_at);
+    CREATE TABLE IF NOT EXISTS documents (
+        hash TEXT PRIMARY KEY,
+        text TEXT NOT NULL,
+        chars INTEGER,
+        created_at REAL,
+        last_seen REAL
+    );
+    CREATE TABLE IF NOT EXISTS document_results (
+        doc_hash TEXT NOT NULL,
+        kind TEXT NOT NULL,
+        params_key TEXT NOT NULL,
+        params TEXT,
+        result TEXT NOT NULL,
+        created_at REAL,
+        PRIMARY KEY (doc_hash, kind, params_key),
+        FOREIGN KEY (doc_hash) REFERENCES documents (hash)
+    );
+    """)
+    for table, column in (("scans", "context"), ("scans", "doc_hash"), ("summary_jobs", "doc_hash")):
+        cols = [col[1] for col in c.execute(f"PRAGMA table_info({table})").fetchall()]
+        if column not in cols:
+            try:
+                c.execute(f"ALTER TABLE {table} ADD COLUMN {column} TEXT;")
+            except:
+                pass
+    c.execute("CREATE INDEX IF NOT EXISTS idx_scans_doc_hash ON scans (doc_hash)")
+    init_scans_fts(conn)
+
+# Full-text index over scan summaries, contexts and input ids. External
+# content table kept in sync with scans by triggers, so every save_scan is
+# indexed; built once from existing rows when first created.
+def init_scans_fts(conn):
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name='scans_fts'").fetchone():
+        return
+    conn.executescript("""
+        CREATE VIRTUAL TABLE scans_fts USING fts5(
+            summary, context, input_text, content='scans', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        );
+        CREATE TRIGGER scans_fts_ai AFTER INSERT ON scans BEGIN
+            INSERT INTO scans_fts(rowid, summary, context, input_text)
+            VALUES (new.id, new.summary, new.context, new.input_text);
+        END;
+        CREATE TRIGGER scans_fts_ad AFTER DELETE ON scans BEGIN
+            INSERT INTO scans_fts(scans_fts, rowid, summary, context, input_text)
+            VALUES ('delete', old.id, old.summary, old.context, old.input_text);
+        END;
+        CREATE TRIGGER scans_fts_au AFTER UPDATE ON scans BEGIN
+            INSERT INTO scans_fts(scans_fts, rowid, summary, context, input_text)
+            VALUES ('delete', old.id, old.summary, old.context, old.input_text);
+            INSERT INTO scans_fts(rowid, summary, context, input_text)
+            VALUES (new.id, new.summary, new.context, new.input_text);
+        END;
+        INSERT INTO scans_fts(scans_fts) VALUES ('rebuild');
+    """)
+
+def save_scan(operator, doc_id, sentiment, summary, context, doc_hash=None):
+    with get_conn() as conn:
+        cur = conn.execute("""
+            INSERT INTO scans (operator, input_text, sentiment, summary, context, doc_hash)
+            VALUES (?,?,?,?,?,?)
+        """, (operator, doc_id, sentiment, summary, context, doc_hash))
+        return cur.lastrowid
+
+# ---------------------------
+# Document store (content-addressed)
+# ---------------------------
+# Uploads are keyed by the SHA-256 of their normalised text, and analysis
+# results are kept per (document, kind, params), so the same document is only
+# ever sent to a service once per set of parameters. Unlike api_cache, these
+# results don't expire.
+def normalize_document(text):
+    text = unicodedata.normalize("NFC", text.lstrip("\ufeff")).replace("\r\n", "\n").replace("\r", "\n")
+    return "\n".join(line.rstrip() for line in text.split("\n")).strip()
+
+def document_hash(text):
+    return hashlib.sha256(normalize_document(text).encode("utf-8")).hexdigest()
+
+# Record a document (once) and return its hash.
+def store_document(text):
+    norm = normalize_document(text)
+    doc_hash = hashlib.sha256(norm.encode("utf-8")).hexdigest()
+    now = time.time()
+    with get_conn() as conn:
+        conn.execute("""
+            INSERT INTO documents (hash, text, chars, created_at, last_seen) VALUES (?,?,?,?,?)
+            ON CONFLICT(hash) DO UPDATE SET last_seen=excluded.last_seen
+        """, (doc_hash, norm, len(norm), now, now))
+    return doc_hash
+
+def get_result(doc_hash, kind, params):
+    with get_conn() as conn:
+        row = conn.execute("SELECT result FROM document_results WHERE doc_hash=? AND kind=? AND params_key=?",
+                           (doc_hash, kind, cache_key(params))).fetchone()
+    return json.loads(row[0]) if row else None
+
+def put_result(doc_hash, kind, params, result):
+    with get_conn() as conn:
+        conn.execute("""
+            INSERT OR REPLACE INTO document_results (doc_hash, kind, params_key, params, result, created_at)
+            VALUES (?,?,?,?,?,?)
+        """, (doc_hash, kind, cache_key(params), json.dumps(params, sort_keys=True),
+              json.dumps(result, ensure_ascii=False), time.time()))
+
+# ---------------------------
+# Response cache (SQLite, TTL + LRU)
+# ---------------------------
+# namespace -> (ttl seconds, max entries). A hit bumps last_used at most once
+# per CACHE_TOUCH_INTERVAL, so hot keys take the write lock about once a
+# minute instead of on every read; expiry and LRU eviction happen in
+# cache_put.
+CACHE_LIMITS = {
+    "serp": (6 * 3600, 2000),
+    "llm": (24 * 3600, 500),
+}
+CACHE_TOUCH_INTERVAL = 60
+
+def cache_key(*parts):
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+def cache_get(namespace, key):
+    ttl, _ = CACHE_LIMITS[namespace]
+    now = time.time()
+    with get_conn() as conn:
+        row = conn.execute("SELECT value, last_used FROM api_cache WHERE namespace=? AND key=? AND created_at >= ?",
+                           (namespace, key, now - ttl)).fetchone()
+        if row is None:
+            return None
+        if row[1] < now - CACHE_TOUCH_INTERVAL:
+            conn.execute("UPDATE api_cache SET last_used=? WHERE namespace=? AND key=? AND last_used < ?",
+                         (now, namespace, key, now - CACHE_TOUCH_INTERVAL))
+    return json.loads(row[0])
+
+def cache_put(namespace, key, value):
+    ttl, max_entries = CACHE_LIMITS[namespace]
+    now = time.time()
+    with transaction() as conn:
+        conn.execute("INSERT OR REPLACE INTO api_cache (namespace, key, value, created_at, last_used) VALUES (?,?,?,?,?)",
+                     (namespace, key, json.dumps(value, ensure_ascii=False), now, now))
+        conn.execute("DELETE FROM api_cache WHERE namespace=? AND created_at < ?", (namespace, now - ttl))
+        conn.execute("""
+            DELETE FROM api_cache WHERE namespace=? AND key NOT IN (
+                SELECT key FROM api_cache WHERE namespace=? ORDER BY last_used DESC LIMIT ?
+            )
+        """, (namespace, namespace, max_entries))
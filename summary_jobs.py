@@ -0,0 +1,186 @@
+import json
+import logging
+import threading
+import time
+from engine import fan_out, get_session
+from services import EMPTY_DOCUMENT, SETTINGS, is_empty_document
+from store import get_conn, get_result, put_result, save_scan, store_document
+
+log = logging.getLogger(__name__)
+
+# ---------------------------
+# Extractive summary job manager
+# ---------------------------
+# Jobs live in summary_jobs so a rerun, reconnect or restart picks them back
+# up. A single background poller per process polls every due job concurrently
+# on the summary pool, backing off per job from SUMMARY_POLL_MIN to
+# SUMMARY_POLL_MAX, and saves finished summaries with save_scan.
+SUMMARY_POLL_MIN = 1.0
+SUMMARY_POLL_MAX = 15.0
+SUMMARY_POLL_GROWTH = 1.6
+SUMMARY_JOB_TIMEOUT = 600
+SUMMARY_PENDING = ("notStarted", "running", "cancelling")
+SUMMARY_CLAIM_LEASE = 60
+SUMMARY_LOOP_BACKOFF_MAX = 30.0
+SUMMARY_PARAMS = {"sentenceCount": 5, "query": "", "language": "en"}
+
+def summary_headers():
+    return {"Content-Type": "application/json", "Ocp-Apim-Subscription-Key": SETTINGS["TAB2_KEY"]}
+
+# Submit one analyze job and record it; returns the job row id. A document
+# summarised before is answered from the document store: its scans are saved
+# and the job is recorded as already succeeded.
+def submit_summary_job(operator, name, text, context):
+    if is_empty_document(text):
+        raise ValueError(EMPTY_DOCUMENT)
+    doc_hash = store_document(text)
+    stored = get_result(doc_hash, "summary", SUMMARY_PARAMS)
+    now = time.time()
+    if stored is not None:
+        texts = [(name, summary_text) for summary_text in stored]
+        for _, summary_text in texts:
+            save_scan(operator, name, '', summary_text, context, doc_hash)
+        with get_conn() as conn:
+            cur = conn.execute("""
+                INSERT INTO summary_jobs (operator, doc_name, context, status, tasks_completed, result,
+                                          submitted_at, updated_at, doc_hash)
+                VALUES (?,?,?,?,?,?,?,?,?)
+            """, (operator, name, context, "succeeded", 1, json.dumps(texts), now, now, doc_hash))
+            return cur.lastrowid
+
+    docs = [{"id": name, "text": text, "language": SUMMARY_PARAMS["language"]}]
+    payload_sum = {"analysisInput": {"documents": docs},
+                   "tasks": [{"kind": "ExtractiveSummarization",
+                              "parameters": {"sentenceCount": str(SUMMARY_PARAMS["sentenceCount"]),
+                                             "query": SUMMARY_PARAMS["query"]}}]}
+    job = get_session("summary").post(SETTINGS["TAB2_URL"], headers=summary_headers(), json=payload_sum, timeout=30)
+    job.raise_for_status()
+    job_loc = job.headers.get('operation-location')
+    if not job_loc:
+        raise RuntimeError("No operation-location returned.")
+    with get_conn() as conn:
+        cur = conn.execute("""
+            INSERT INTO summary_jobs (operator, doc_name, context, operation_location, status,
+                                      poll_interval, next_poll_at, submitted_at, updated_at, doc_hash)
+            VALUES (?,?,?,?,?,?,?,?,?,?)
+        """, (operator, name, context, job_loc, "notStarted", SUMMARY_POLL_MIN, now + SUMMARY_POLL_MIN, now, now,
+              doc_hash))
+        return cur.lastrowid
+
+def summary_texts(result):
+    texts = []
+    for item in result.get('tasks', {}).get('items', []):
+        for doc in item.get('results', {}).get('documents', []):
+            texts.append((doc.get('id'), " ".join([s.get('text','') for s in doc.get('sentences',[])])))
+    return texts
+
+def finish_summary_job(job_id, status, result=None, error=None):
+    with get_conn() as conn:
+        conn.execute("UPDATE summary_jobs SET status=?, result=?, error=?, updated_at=? WHERE id=?",
+                     (status, json.dumps(result) if result is not None else None, error, time.time(), job_id))
+
+def poll_summary_job(job):
+    job_id, operator, name, context, job_loc, interval, submitted_at, doc_hash = job
+    now = time.time()
+    if now - submitted_at > SUMMARY_JOB_TIMEOUT:
+        finish_summary_job(job_id, "failed", error=f"Job did not finish within {SUMMARY_JOB_TIMEOUT} s.")
+        return
+    poll = get_session("summary").get(job_loc, headers=summary_headers(), timeout=30)
+    poll.raise_for_status()
+    pj = poll.json()
+    status = pj.get('status')
+    tasks = pj.get('tasks', {})
+    if status in ('succeeded', 'partiallyCompleted'):
+        texts = summary_texts(pj)
+        for doc_id, summary_text in texts:
+            save_scan(operator, name, '', summary_text, context, doc_hash)
+        # a partial run or an empty result is shown but not reused for the document
+        stored = [summary_text for _, summary_text in texts if summary_text]
+        if doc_hash and status == "succeeded" and stored:
+            put_result(doc_hash, "summary", SUMMARY_PARAMS, stored)
+        finish_summary_job(job_id, "succeeded", result=texts)
+    elif status in ('failed', 'cancelled'):
+        finish_summary_job(job_id, status, error=json.dumps(pj.get('errors', pj)))
+    else:
+        interval = min(interval * SUMMARY_POLL_GROWTH, SUMMARY_POLL_MAX)
+        with get_conn() as conn:
+            conn.execute("""
+                UPDATE summary_jobs SET status=?, tasks_completed=?, tasks_total=?, poll_interval=?,
+                                        next_poll_at=?, updated_at=?, error=NULL
+                WHERE id=?
+            """, (status or "running", tasks.get('completed', 0), tasks.get('total', 1) or 1,
+                  interval, now + interval, now, job_id))
+
+# Due jobs are claimed by pushing next_poll_at past SUMMARY_CLAIM_LEASE, so the
+# UI poller and a headless fetch.py run sharing the database never poll (and
+# save) the same job twice; the poll itself then sets the real next_poll_at.
+def claim_summary_job(job):
+    now = time.time()
+    with get_conn() as conn:
+        cur = conn.execute("UPDATE summary_jobs SET next_poll_at=? WHERE id=? AND next_poll_at <= ?",
+                           (now + SUMMARY_CLAIM_LEASE, job[0], now))
+        return cur.rowcount == 1
+
+# One polling pass over every due job (or only job_ids), run concurrently on
+# the summary pool.
+def poll_due_summary_jobs(job_ids=None):
+    marks = ",".join("?" * len(SUMMARY_PENDING))
+    with get_conn() as conn:
+        due = conn.execute(f"""
+            SELECT id, operator, doc_name, context, operation_location, poll_interval, submitted_at, doc_hash
+            FROM summary_jobs WHERE status IN ({marks}) AND next_poll_at <= ?
+        """, (*SUMMARY_PENDING, time.time())).fetchall()
+    if job_ids is not None:
+        due = [job for job in due if job[0] in job_ids]
+    due = [job for job in due if claim_summary_job(job)]
+    for job, _, exc in fan_out("summary", poll_summary_job, due):
+        if exc is not None:
+            # transient poll failure: retry this job after its current interval
+            log.warning("Polling summary job %s failed: %s", job[0], exc)
+            with get_conn() as conn:
+                conn.execute("UPDATE summary_jobs SET next_poll_at=?, error=? WHERE id=?",
+                             (time.time() + job[5], str(exc), job[0]))
+
+# A failed pass (database locked, schema missing, ...) is logged and written
+# to the pending jobs' error column, where the job panel shows it; passes
+# back off while the failure persists and the error clears on the next
+# successful poll of each job.
+def record_poll_error(exc):
+    marks = ",".join("?" * len(SUMMARY_PENDING))
+    with get_conn() as conn:
+        conn.execute(f"UPDATE summary_jobs SET error=?, updated_at=? WHERE status IN ({marks})",
+                     (f"Summary poller error: {exc}", time.time(), *SUMMARY_PENDING))
+
+def summary_poll_loop():
+    failures = 0
+    while True:
+        try:
+            poll_due_summary_jobs()
+            failures = 0
+        except Exception as e:
+            failures += 1
+            log.exception("Summary poll pass failed")
+            try:
+                record_poll_error(e)
+            except Exception:
+                log.exception("Could not record the summary poller error")
+        time.sleep(min(0.5 * 2 ** failures, SUMMARY_LOOP_BACKOFF_MAX))
+
+# One poller thread per process, started by the first caller.
+SUMMARY_POLLER = []
+SUMMARY_POLLER_LOCK = threading.Lock()
+
+def get_summary_poller():
+    with SUMMARY_POLLER_LOCK:
+        if not SUMMARY_POLLER:
+            poller = threading.Thread(target=summary_poll_loop, name="cyclops-summary-poller", daemon=True)
+            poller.start()
+            SUMMARY_POLLER.append(poller)
+        return SUMMARY_POLLER[0]
+
+def fetch_summary_jobs(operator, limit=50):
+    with get_conn() as conn:
+        return conn.execute("""
+            SELECT id, doc_name, status, tasks_completed, tasks_total, result, error, submitted_at
+            FROM summary_jobs WHERE operator=? ORDER BY submitted_at DESC LIMIT ?
+        """, (operator, limit)).fetchall()